@@ -13,7 +13,11 @@ import os
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 from read_koref import read_yaml
+from koref_bounds import optimality_gap
+from koref_chain import CHAIN_INCUMBENT_SIZE, chain_incumbent
 from koref_domain import create_model, solve
+from koref_preprocess import preprocess
+from koref_warmstart import WARM_START_TIME_LIMIT, warm_start
 from koref_utils import compute_expected_makespan, compute_earliest_start_schedule
 
 
@@ -49,19 +53,33 @@ def solve_refined(instance_path, time_limit=30):
     """Solve a problem instance and return results."""
     name, n, durations, probabilities, precedence = read_yaml(instance_path)
     
+    build_start = time.time()
+    model_precedence, fixed = preprocess(n, durations, probabilities, precedence)
     model, pair_to_info, initial_prec, unresolved_pair_map, duration_table, prob_table = create_model(
-        n, durations, probabilities, precedence
+        n, durations, probabilities, model_precedence
     )
+    build_time = time.time() - build_start
     
     start_time = time.time()
     
+    # Warm start: the solver starts from the best quick refinement (the
+    # ratio chain on instances this size, see koref_chain)
+    if n >= CHAIN_INCUMBENT_SIZE:
+        incumbent_precedence, incumbent_makespan, incumbent_source, incumbent_time = chain_incumbent(
+            n, durations, probabilities, precedence
+        )
+    else:
+        incumbent_precedence, incumbent_makespan, incumbent_source, incumbent_time = warm_start(
+            n, durations, probabilities, precedence, time_limit=min(WARM_START_TIME_LIMIT, 0.1 * time_limit)
+        )
+    
     # Create temp history file
     import tempfile
     history_file = tempfile.NamedTemporaryFile(mode='w', suffix='.txt', delete=False, encoding='utf-8')
     history_file.close()
     
     try:
-        refined_precedence, refined_makespan, _, is_optimal, is_timeout = solve(
+        refined_precedence, refined_makespan, bound, is_optimal, is_timeout = solve(
             model,
             pair_to_info,
             n,
@@ -73,7 +91,9 @@ def solve_refined(instance_path, time_limit=30):
             prob_table,
             "Optimal",
             history_file.name,
-            time_limit=time_limit
+            time_limit=time_limit,
+            original_precedence=precedence,
+            incumbent=(incumbent_precedence, incumbent_makespan),
         )
     finally:
         if os.path.exists(history_file.name):
@@ -81,7 +101,9 @@ def solve_refined(instance_path, time_limit=30):
     
     runtime = time.time() - start_time
     
-    return refined_makespan, is_optimal, runtime, not is_timeout
+    return refined_makespan, is_optimal, runtime, not is_timeout, build_time, bound, len(fixed), (
+        incumbent_makespan, incumbent_source, incumbent_time
+    )
 
 
 def benchmark_ultra_large(time_limit=30, output_csv="ultra_large_results.csv"):
@@ -112,7 +134,7 @@ def benchmark_ultra_large(time_limit=30, output_csv="ultra_large_results.csv"):
             original_makespan = compute_expected_makespan(activities_list, schedule, durations, probabilities)
             
             # Solve
-            refined_makespan, is_optimal, runtime, completed = solve_refined(problem['path'], time_limit)
+            refined_makespan, is_optimal, runtime, completed, build_time, bound, fixed_pairs, incumbent = solve_refined(problem['path'], time_limit)
             
             if refined_makespan is None:
                 print("FAILED")
@@ -126,6 +148,14 @@ def benchmark_ultra_large(time_limit=30, output_csv="ultra_large_results.csv"):
                     'improvement': None,
                     'improvement_pct': None,
                     'runtime': runtime,
+                    'build_time': build_time,
+                    'lower_bound': bound,
+                    'fixed_pairs': fixed_pairs,
+                    'gap_pct': None,
+                    'incumbent': incumbent[0],
+                    'incumbent_source': incumbent[1],
+                    'incumbent_time': incumbent[2],
+                    'incumbent_gap_pct': None if bound is None else 100 * optimality_gap(incumbent[0], bound),
                     'optimal': False,
                     'completed': completed,
                     'status': 'FAILED'
@@ -140,7 +170,7 @@ def benchmark_ultra_large(time_limit=30, output_csv="ultra_large_results.csv"):
                 elif not is_optimal:
                     status = 'HEURISTIC'
                 
-                print(f"{'[OK]' if completed else '[TIMEOUT]'} Runtime: {runtime:.3f}s, Improvement: {improvement_pct:.2f}%")
+                print(f"{'[OK]' if completed else '[TIMEOUT]'} Runtime: {runtime:.3f}s, Build: {build_time:.3f}s, Improvement: {improvement_pct:.2f}%, Gap: {100 * optimality_gap(refined_makespan, bound):.2f}%")
                 
                 results.append({
                     'instance': problem['name'],
@@ -152,6 +182,14 @@ def benchmark_ultra_large(time_limit=30, output_csv="ultra_large_results.csv"):
                     'improvement': improvement,
                     'improvement_pct': improvement_pct,
                     'runtime': runtime,
+                    'build_time': build_time,
+                    'lower_bound': bound,
+                    'fixed_pairs': fixed_pairs,
+                    'gap_pct': 100 * optimality_gap(refined_makespan, bound),
+                    'incumbent': incumbent[0],
+                    'incumbent_source': incumbent[1],
+                    'incumbent_time': incumbent[2],
+                    'incumbent_gap_pct': 100 * optimality_gap(incumbent[0], bound),
                     'optimal': is_optimal,
                     'completed': completed,
                     'status': status
@@ -169,6 +207,14 @@ def benchmark_ultra_large(time_limit=30, output_csv="ultra_large_results.csv"):
                 'improvement': None,
                 'improvement_pct': None,
                 'runtime': None,
+                'build_time': None,
+                'lower_bound': None,
+                'fixed_pairs': None,
+                'gap_pct': None,
+                'incumbent': None,
+                'incumbent_source': None,
+                'incumbent_time': None,
+                'incumbent_gap_pct': None,
                 'optimal': False,
                 'completed': False,
                 'status': f'ERROR: {str(e)}'
@@ -178,7 +224,8 @@ def benchmark_ultra_large(time_limit=30, output_csv="ultra_large_results.csv"):
     with open(output_csv, 'w', newline='', encoding='utf-8') as f:
         writer = csv.DictWriter(f, fieldnames=[
             'instance', 'n', 'risk_level', 'instance_id', 'original', 'refined',
-            'improvement', 'improvement_pct', 'runtime', 'optimal', 'completed', 'status'
+            'improvement', 'improvement_pct', 'runtime', 'build_time', 'lower_bound', 'fixed_pairs', 'gap_pct',
+            'incumbent', 'incumbent_source', 'incumbent_time', 'incumbent_gap_pct', 'optimal', 'completed', 'status'
         ])
         writer.writeheader()
         writer.writerows(results)
@@ -234,6 +281,24 @@ def generate_report(results, output_file):
                 f.write(f"- **Max Runtime**: {valid_runtimes.max():.3f}s\n")
                 f.write(f"- **Min Runtime**: {valid_runtimes.min():.3f}s\n")
         
+        if 'build_time' in df.columns:
+            valid_builds = df[df['build_time'].notna()]['build_time']
+            if len(valid_builds) > 0:
+                f.write(f"- **Average Model Build Time**: {valid_builds.mean():.3f}s\n")
+                f.write(f"- **Max Model Build Time**: {valid_builds.max():.3f}s\n")
+        
+        if 'gap_pct' in df.columns:
+            valid_gaps = df[df['gap_pct'].notna()]['gap_pct']
+            if len(valid_gaps) > 0:
+                f.write(f"- **Average Optimality Gap** (vs. lower bound): {valid_gaps.mean():.2f}%\n")
+                f.write(f"- **Max Optimality Gap**: {valid_gaps.max():.2f}%\n")
+        
+        if 'incumbent_gap_pct' in df.columns:
+            valid_incumbents = df[df['incumbent_gap_pct'].notna()]
+            if len(valid_incumbents) > 0:
+                f.write(f"- **Average Warm-Start Gap** (vs. lower bound): {valid_incumbents['incumbent_gap_pct'].mean():.2f}%\n")
+                f.write(f"- **Average Time to Incumbent**: {valid_incumbents['incumbent_time'].mean():.3f}s\n")
+        
         f.write("\n## Results by Risk Level\n\n")
         
         for risk_level in ['high', 'medium', 'low']:
@@ -263,6 +328,11 @@ def generate_report(results, output_file):
                         f.write(f"- **Average Runtime**: {valid_runtimes.mean():.3f}s\n")
                         f.write(f"- **Max Runtime**: {valid_runtimes.max():.3f}s\n")
                 
+                if 'build_time' in risk_df.columns:
+                    valid_builds = risk_df[risk_df['build_time'].notna()]['build_time']
+                    if len(valid_builds) > 0:
+                        f.write(f"- **Average Model Build Time**: {valid_builds.mean():.3f}s\n")
+                
                 f.write("\n")
         
         f.write("## Detailed Results\n\n")
@@ -17,7 +17,11 @@ from koref_utils import (
     compute_earliest_start_schedule,
     compute_expected_makespan,
 )
+from koref_bounds import optimality_gap
+from koref_branch_bound import solve_native_bb
 from koref_domain import create_model, solve
+from koref_preprocess import preprocess
+from koref_warmstart import WARM_START_TIME_LIMIT, warm_start
 
 
 def find_all_problems():
@@ -77,40 +81,69 @@ def compute_original_makespan(instance_path):
     return expected_makespan
 
 
-def solve_refined(instance_path, time_limit=30):
-    """Solve the refinement problem and return refined makespan and runtime."""
+def solve_refined(instance_path, time_limit=30, engine="Optimal"):
+    """
+    Solve the refinement problem and return refined makespan, runtime, model build time and lower bound.
+    
+    engine selects the exhaustive search: "Optimal" (DIDP BrFS over the pair
+    model) or "NativeBB" (koref_branch_bound.solve_native_bb).
+    """
     name, n, durations, probabilities, precedence = read_koref.read(instance_path)
     
     # Create model
-    model, pair_to_info, initial_precedence, unresolved_pair_map, duration_table, prob_table = create_model(
-        n, durations, probabilities, precedence
-    )
+    build_start = time.time()
+    model_precedence, fixed = preprocess(n, durations, probabilities, precedence)
+    if engine != "NativeBB":
+        model, pair_to_info, initial_precedence, unresolved_pair_map, duration_table, prob_table = create_model(
+            n, durations, probabilities, model_precedence
+        )
+    build_time = time.time() - build_start
     
     start_time = time.time()
     
-    # Solve with optimal exhaustive search
-    history = []  # Empty history
-    refined_precedence, refined_makespan, _, is_optimal, is_timeout = solve(
-        model,
-        pair_to_info,
-        n,
-        durations,
-        probabilities,
-        initial_precedence,
-        unresolved_pair_map,
-        duration_table,
-        prob_table,
-        "Optimal",  # solver_name
-        history,
-        time_limit=time_limit
+    # Warm start: the solver starts from the best quick refinement
+    incumbent_precedence, incumbent_makespan, incumbent_source, incumbent_time = warm_start(
+        n, durations, probabilities, precedence, time_limit=min(WARM_START_TIME_LIMIT, 0.1 * time_limit)
     )
     
+    if engine == "NativeBB":
+        refined_precedence, refined_makespan, bound, is_optimal, is_timeout = solve_native_bb(
+            n,
+            durations,
+            probabilities,
+            precedence,
+            model_precedence=model_precedence,
+            time_limit=time_limit,
+            incumbent=(incumbent_precedence, incumbent_makespan),
+        )
+    else:
+        # Solve with optimal exhaustive search
+        history = []  # Empty history
+        refined_precedence, refined_makespan, bound, is_optimal, is_timeout = solve(
+            model,
+            pair_to_info,
+            n,
+            durations,
+            probabilities,
+            initial_precedence,
+            unresolved_pair_map,
+            duration_table,
+            prob_table,
+            "Optimal",  # solver_name
+            history,
+            time_limit=time_limit,
+            original_precedence=precedence,
+            incumbent=(incumbent_precedence, incumbent_makespan),
+        )
+    
     runtime = time.time() - start_time
     
-    return refined_makespan, is_optimal, runtime, not is_timeout
+    return refined_makespan, is_optimal, runtime, not is_timeout, build_time, bound, len(fixed), (
+        incumbent_makespan, incumbent_source, incumbent_time
+    )
 
 
-def run_benchmark(time_limit=30, output_prefix="benchmark_unified"):
+def run_benchmark(time_limit=30, output_prefix="benchmark_unified", engine="Optimal"):
     """Run benchmark on all problems."""
     problems = find_all_problems()
     
@@ -123,6 +156,7 @@ def run_benchmark(time_limit=30, output_prefix="benchmark_unified"):
     print("=" * 100)
     print(f"Found {len(problems)} problems")
     print(f"Time limit per problem: {time_limit}s")
+    print(f"Search engine: {engine}")
     print("=" * 100)
     print()
     
@@ -142,8 +176,8 @@ def run_benchmark(time_limit=30, output_prefix="benchmark_unified"):
             print(f"  Original makespan: {original_makespan:.6f}")
             
             # Solve refinement
-            refined_makespan, is_optimal, runtime, success = solve_refined(
-                instance_path, time_limit=time_limit
+            refined_makespan, is_optimal, runtime, success, build_time, bound, fixed_pairs, incumbent = solve_refined(
+                instance_path, time_limit=time_limit, engine=engine
             )
             
             if success and refined_makespan is not None:
@@ -161,13 +195,22 @@ def run_benchmark(time_limit=30, output_prefix="benchmark_unified"):
                     'improvement': improvement,
                     'improvement_pct': improvement_pct,
                     'runtime': runtime,
+                    'build_time': build_time,
+                    'lower_bound': bound,
+                    'fixed_pairs': fixed_pairs,
+                    'gap_pct': 100 * optimality_gap(refined_makespan, bound),
+                    'incumbent': incumbent[0],
+                    'incumbent_source': incumbent[1],
+                    'incumbent_time': incumbent[2],
+                    'incumbent_gap_pct': 100 * optimality_gap(incumbent[0], bound),
                     'optimal': is_optimal,
                     'status': 'OK' if is_optimal else 'HEURISTIC'
                 })
                 
                 print(f"  Refined makespan: {refined_makespan:.6f}")
                 print(f"  Improvement: {improvement:.6f} ({improvement_pct:.2f}%)")
-                print(f"  Runtime: {runtime:.2f}s")
+                print(f"  Lower bound: {bound:.6f} (gap: {100 * optimality_gap(refined_makespan, bound):.2f}%)")
+                print(f"  Runtime: {runtime:.2f}s (model build: {build_time:.3f}s)")
                 print(f"  Status: {'Optimal' if is_optimal else 'Heuristic'}")
             else:
                 results.append({
@@ -181,6 +224,14 @@ def run_benchmark(time_limit=30, output_prefix="benchmark_unified"):
                     'improvement': None,
                     'improvement_pct': None,
                     'runtime': runtime,
+                    'build_time': build_time,
+                    'lower_bound': bound,
+                    'fixed_pairs': fixed_pairs,
+                    'gap_pct': None,
+                    'incumbent': incumbent[0],
+                    'incumbent_source': incumbent[1],
+                    'incumbent_time': incumbent[2],
+                    'incumbent_gap_pct': None if bound is None else 100 * optimality_gap(incumbent[0], bound),
                     'optimal': False,
                     'status': 'TIMEOUT' if runtime >= time_limit else 'FAIL'
                 })
@@ -204,6 +255,14 @@ def run_benchmark(time_limit=30, output_prefix="benchmark_unified"):
                 'improvement': None,
                 'improvement_pct': None,
                 'runtime': None,
+                'build_time': None,
+                'lower_bound': None,
+                'fixed_pairs': None,
+                'gap_pct': None,
+                'incumbent': None,
+                'incumbent_source': None,
+                'incumbent_time': None,
+                'incumbent_gap_pct': None,
                 'optimal': False,
                 'status': f'ERROR: {str(e)[:30]}'
             })
@@ -216,6 +275,16 @@ def run_benchmark(time_limit=30, output_prefix="benchmark_unified"):
     return results
 
 
+def build_time_by_size(results):
+    """Return (size, count, avg, max) model build times per size class."""
+    stats = []
+    for size in ["small", "medium", "large", "very_large"]:
+        times = [r['build_time'] for r in results if r['size'] == size and r.get('build_time') is not None]
+        if times:
+            stats.append((size, len(times), sum(times) / len(times), max(times)))
+    return stats
+
+
 def save_results(results, prefix="benchmark_unified"):
     """Save results to CSV and Markdown files."""
     # CSV file
@@ -259,6 +328,22 @@ def save_results(results, prefix="benchmark_unified"):
             avg_imp = sum(r['improvement_pct'] for r in improved) / len(improved)
             f.write(f"- **Problems with improvement**: {len(improved)}/{len(successful) + len(heuristic)} ({len(improved)/(len(successful) + len(heuristic))*100:.1f}%)\n")
             f.write(f"- **Average improvement** (for improved): {avg_imp:.2f}%\n")
+        gaps = [r['gap_pct'] for r in successful + heuristic if r.get('gap_pct') is not None]
+        if gaps:
+            f.write(f"- **Average optimality gap** (vs. lower bound): {sum(gaps) / len(gaps):.2f}%\n")
+            f.write(f"- **Max optimality gap**: {max(gaps):.2f}%\n")
+        incumbents = [r for r in successful + heuristic if r.get('incumbent_gap_pct') is not None]
+        if incumbents:
+            f.write(f"- **Average warm-start gap** (vs. lower bound): {sum(r['incumbent_gap_pct'] for r in incumbents) / len(incumbents):.2f}%\n")
+            f.write(f"- **Average time to incumbent**: {sum(r['incumbent_time'] for r in incumbents) / len(incumbents):.3f}s\n")
+        
+        build_stats = build_time_by_size(results)
+        if build_stats:
+            f.write(f"\n## Model Build Time by Size Class\n\n")
+            f.write("| Size | Problems | Avg Build (s) | Max Build (s) |\n")
+            f.write("|------|----------|---------------|---------------|\n")
+            for size, count, avg_build, max_build in build_stats:
+                f.write(f"| {size} | {count} | {avg_build:.3f} | {max_build:.3f} |\n")
         
         # Print console summary
         print("\n" + "=" * 100)
@@ -272,6 +357,8 @@ def save_results(results, prefix="benchmark_unified"):
             avg_imp = sum(r['improvement_pct'] for r in improved) / len(improved)
             print(f"Problems with improvement: {len(improved)}/{len(successful) + len(heuristic)} ({len(improved)/(len(successful) + len(heuristic))*100:.1f}%)")
             print(f"Average improvement (for improved): {avg_imp:.2f}%")
+        for size, count, avg_build, max_build in build_stats:
+            print(f"Model build time [{size}]: avg {avg_build:.3f}s, max {max_build:.3f}s ({count} problems)")
         print("=" * 100)
     
     print(f"Results saved to {md_path}")
@@ -285,11 +372,14 @@ if __name__ == "__main__":
                        help="Time limit per problem in seconds (default: 30)")
     parser.add_argument("--output", default="benchmark_unified",
                        help="Output file prefix (default: benchmark_unified)")
+    parser.add_argument("--engine", choices=["Optimal", "NativeBB"], default="Optimal",
+                       help="Exhaustive search engine (default: Optimal)")
     
     args = parser.parse_args()
     
     run_benchmark(
         time_limit=args.time_limit,
-        output_prefix=args.output
+        output_prefix=args.output,
+        engine=args.engine,
     )
 
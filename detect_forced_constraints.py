@@ -19,10 +19,13 @@ def compute_dominance_constraints(n: int, durations: List[float], probabilities:
     - duration_i <= duration_j AND
     - p_i >= p_j
     
-    In this case, i < j should be in any optimal solution.
+    Dominance alone does not force i < j: running i and j in parallel can be
+    strictly better (e.g. d = 1, 2 and p = 0.1, 0). koref_preprocess fixes
+    the subset that is provably safe (dominance between twins, for
+    linear-extension search).
     
     Returns:
-        Set of (i, j) pairs where i < j is forced
+        Set of (i, j) pairs where i dominates j
     """
     forced = set()
     
@@ -101,8 +104,8 @@ def analyze_problem(problem_path: str):
     # Compute dominance constraints
     dominance = compute_dominance_constraints(n, durations, probabilities)
     
-    print(f"\n--- DOMINANCE ANALYSIS (PROVABLY CORRECT) ---")
-    print(f"Forced constraints by dominance: {len(dominance)}")
+    print(f"\n--- DOMINANCE ANALYSIS (SAFE ONLY BETWEEN TWINS, SEE koref_preprocess) ---")
+    print(f"Dominance pairs: {len(dominance)}")
     
     if dominance:
         print("\nDominance-forced constraints:")
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""
+Admissible lower bounds on the expected makespan of KORef refinements.
+
+The expected makespan of a schedule equals the integral over time of the
+probability that the project is still running:
+
+    E = integral_0^T prod_{a : abort_a < t} (1 - p_a) dt
+
+Adding precedence constraints can only delay activities, and an activity
+never aborts before it finishes. So in every refinement of a partial
+refinement R, each activity aborts no earlier than its earliest finish time
+under R, and the project ends no earlier than R's critical path. Replacing
+every abort time by that earliest finish gives a pointwise smaller integrand
+over a shorter horizon: a valid lower bound on the best expected makespan
+reachable from R (the "own-finish relaxation"). It is exact when no two
+activities of R's schedule overlap.
+
+The same relaxation, restricted to the unscheduled activities, is available
+as a DIDP dual bound expression for models whose transition costs are exact
+increments of the expected makespan (see create_stage_model).
+
+start_search and search_result hold the setup and the result reporting that
+the Python search engines share.
+"""
+
+import time
+
+import numpy as np
+
+import didppy as dp
+
+from koref_utils import compute_earliest_start_schedule, compute_expected_makespan_fast
+
+# Nodes (or complete refinements) between two time-limit checks of the
+# Python search engines
+TIME_CHECK_INTERVAL = 1024
+
+
+def relaxed_makespan_array(finishes, probabilities):
+    """
+    Own-finish relaxation for given earliest finish times.
+
+    Args:
+        finishes: Sequence of finish times, indexed by position
+        probabilities: Sequence of KO probabilities, aligned with finishes
+
+    Returns:
+        Expected makespan when every activity aborts at its own finish time
+    """
+    finishes = np.asarray(finishes, dtype=float)
+    if finishes.size == 0:
+        return 0.0
+    probabilities = np.asarray(probabilities, dtype=float)
+
+    order = np.argsort(finishes, kind="stable")
+    sorted_finishes = finishes[order]
+    bucket_starts = np.flatnonzero(np.r_[True, sorted_finishes[1:] != sorted_finishes[:-1]])
+    t = sorted_finishes[bucket_starts]
+    Q = np.multiply.reduceat(1.0 - probabilities[order], bucket_starts)
+
+    # E = sum_j (t_j - t_{j-1}) * P_{j-1}
+    P = np.empty(len(Q))
+    P[0] = 1.0
+    np.cumprod(Q[:-1], out=P[1:])
+    widths = np.diff(t, prepend=0.0)
+    return float(np.dot(widths, P))
+
+
+def lower_bound_from_starts(starts, durations, probabilities):
+    """
+    Lower bound for every refinement of a relation with earliest starts `starts`.
+
+    Python-side search can call this with the start times it already keeps
+    (e.g. IncrementalEvaluator.starts) to prune a partial refinement.
+
+    Args:
+        starts: Sequence of earliest start times of the partial refinement
+        durations: Sequence of durations, aligned with starts
+        probabilities: Sequence of KO probabilities, aligned with starts
+
+    Returns:
+        Lower bound (float)
+    """
+    finishes = np.asarray(starts, dtype=float) + np.asarray(durations, dtype=float)
+    return relaxed_makespan_array(finishes, probabilities)
+
+
+def lower_bound(n, durations, probabilities, precedence):
+    """
+    Lower bound on the expected makespan of every acyclic refinement of precedence.
+
+    Args:
+        n: Number of activities
+        durations: List of durations
+        probabilities: List of KO probabilities
+        precedence: Acyclic PrecedenceRelation or dict mapping (a, b) -> True
+
+    Returns:
+        Lower bound (float), never larger than the expected makespan of
+        precedence itself or of any refinement of it
+    """
+    activities = list(range(n))
+    schedule = compute_earliest_start_schedule(activities, precedence, durations)
+    starts = [schedule.get(a, 0.0) for a in activities]
+    return lower_bound_from_starts(starts, durations, probabilities)
+
+
+def optimality_gap(cost, bound):
+    """
+    Relative gap (cost - bound) / cost, or None if either value is missing.
+    """
+    if cost is None or bound is None:
+        return None
+    if cost <= 0:
+        return 0.0
+    return max(cost - bound, 0.0) / cost
+
+
+def gap_closed(cost, bound, gap=None, absolute_gap=None):
+    """
+    Return True if cost is provably optimal or within a gap target of bound.
+
+    Args:
+        cost: Expected makespan of the incumbent (None: nothing to compare)
+        bound: Global lower bound (None: nothing to compare)
+        gap: Relative target on optimality_gap(cost, bound) (None: not used)
+        absolute_gap: Target on cost - bound (None: not used)
+    """
+    if cost is None or bound is None:
+        return False
+    if cost <= bound:
+        return True
+    if absolute_gap is not None and cost - bound <= absolute_gap:
+        return True
+    return gap is not None and optimality_gap(cost, bound) <= gap
+
+
+def start_search(
+    n, durations, probabilities, precedence, incumbent=None, gap=None, absolute_gap=None
+):
+    """
+    Root bound and starting incumbent of a Python search engine.
+
+    The input precedence is itself a refinement, so it is the first
+    incumbent; a given incumbent replaces it if it is better.
+
+    Args:
+        n: Number of activities
+        durations: List of durations
+        probabilities: List of KO probabilities
+        precedence: Input PrecedenceRelation
+        incumbent: Optional (refined_precedence, expected_makespan) to beat
+        gap, absolute_gap: Gap targets as in gap_closed
+
+    Returns:
+        root_bound: lower_bound of precedence
+        best_precedence: The better of precedence and the incumbent
+        best_cost: Its expected makespan
+        is_closed: True if best_cost already meets the gap targets
+    """
+    root_bound = lower_bound(n, durations, probabilities, precedence)
+    print(f"Lower bound (own-finish relaxation): {root_bound:.6f}")
+
+    activities = list(range(n))
+    schedule = compute_earliest_start_schedule(activities, precedence, durations)
+    best_precedence = precedence.copy()
+    best_cost = compute_expected_makespan_fast(activities, schedule, durations, probabilities)
+    print(f"Original precedence makespan: {best_cost:.6f}")
+    if incumbent is not None and incumbent[1] < best_cost:
+        best_precedence, best_cost = incumbent
+        print(f"Incumbent makespan: {best_cost:.6f}")
+
+    is_closed = gap_closed(best_cost, root_bound, gap, absolute_gap)
+    if is_closed:
+        print(f"Gap closed before search: {100 * optimality_gap(best_cost, root_bound):.2f}%")
+    return root_bound, best_precedence, best_cost, is_closed
+
+
+def search_result(best_precedence, best_cost, bound, is_timeout, start_time):
+    """
+    Report a finished search and build the tuple solve() returns.
+
+    Args:
+        best_precedence: Best refinement found
+        best_cost: Its expected makespan
+        bound: Lower bound on every refinement of the input; best_cost is
+            only optimal when it reaches this bound
+        is_timeout: True if the time limit ended the search
+        start_time: time.perf_counter() at the start of the search
+
+    Returns:
+        (best_precedence, best_cost, bound, is_optimal, is_timeout)
+    """
+    print(f"Search time: {time.perf_counter() - start_time:.3f}s")
+    print(f"Optimality gap: {100 * optimality_gap(best_cost, bound):.2f}%")
+    return (
+        best_precedence,
+        best_cost,
+        bound,
+        best_cost <= bound,
+        is_timeout,
+    )
+
+
+def relaxation_dual_bound(
+    model, object_type, durations, survival_table, remaining, elapsed, max_levels=None
+):
+    """
+    DIDP expression for the own-finish relaxation over a set of remaining activities.
+
+    Measured from a time origin at which every remaining activity can start
+    at the earliest, the value is
+
+        integral_elapsed^{max d(remaining)} prod_{u in remaining, d_u < tau} (1 - p_u) dtau
+
+    written as one term per duration level. Multiplied by a survival
+    probability that every later time point is weighted with at least, it
+    bounds the cost still to be paid after `elapsed` time units have already
+    been charged.
+
+    Each term costs a few set operations per evaluated state. With
+    max_levels, only that many distinct durations (evenly spaced in sorted
+    order, always including the largest) are used as levels. Each interval
+    then takes the survival of every activity shorter than its right end, and
+    the integral is still a lower bound, just a weaker one.
+
+    Args:
+        model: DIDP model the expression is built for
+        object_type: Object type of the activity set variables
+        durations: List of durations
+        survival_table: Float table of 1 - p per activity in model
+        remaining: Set expression of the remaining activities
+        elapsed: Float expression of the time already charged since the origin
+        max_levels: Maximum number of duration levels (None uses all)
+
+    Returns:
+        FloatExpr (0 if remaining is empty)
+    """
+    levels = sorted({d for d in durations if d > 0})
+    if max_levels is not None and len(levels) > max_levels:
+        step = len(levels) / max(max_levels, 1)
+        levels = [levels[int(round((k + 1) * step)) - 1] for k in range(max_levels)]
+
+    bound = dp.FloatExpr(0.0)
+    previous = 0.0
+    for level in levels:
+        # Some remaining activity is still running at every point of (previous, level]
+        reaching = model.create_set_const(
+            object_type=object_type,
+            value=[a for a, d in enumerate(durations) if d >= level],
+        )
+        # Remaining activities that may already have aborted during that interval
+        finished = model.create_set_const(
+            object_type=object_type,
+            value=[a for a, d in enumerate(durations) if d < level],
+        )
+        width = dp.max(level - dp.max(elapsed, previous), 0.0)
+        bound = bound + (~(remaining & reaching).is_empty()).if_then_else(
+            width * survival_table.product(remaining & finished),
+            0.0,
+        )
+        previous = level
+    return bound
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Native depth-first branch-and-bound for KORef ("NativeBB").
+
+The search space is the one of the "Optimal" pair model: every unresolved
+pair is oriented one way or the other, so the leaves are the linear
+extensions of the (preprocessed) precedence. Decisions are made depth first
+on an IncrementalEvaluator, which keeps the transitive closure and the
+earliest-start schedule up to date and undoes each decision in time
+proportional to what it changed. Pairs that earlier decisions already
+ordered transitively are skipped, and with symmetry breaking interchangeable
+activities are only ordered by index, as in create_model.
+
+Every node is pruned when the own-finish relaxation of its schedule
+(koref_bounds.lower_bound_from_starts) is not below the incumbent: no
+refinement of the node can do better. Every node is also a refinement of the
+input, so its expected makespan is offered as an incumbent on the way down.
+
+The search keeps one frame per decision on an explicit stack, so memory is
+proportional to the search depth (at most the number of unresolved pairs)
+instead of a BrFS layer. Each frame also keeps the bound of its node, so the
+smallest bound over frames with options left bounds every linear extension
+not explored yet. This live bound rises as subtrees are exhausted, and the
+gap targets are checked against it, so the search can stop before it is
+exhausted. It says nothing about the refinements that are not linear
+extensions, so it is only used to stop: the returned bound is the root bound,
+and exhausting the search does not make the result optimal.
+"""
+
+import time
+
+from koref_bounds import (
+    TIME_CHECK_INTERVAL,
+    gap_closed,
+    lower_bound_from_starts,
+    search_result,
+    start_search,
+)
+from koref_evaluator import IncrementalEvaluator
+from koref_preprocess import class_index, interchangeable_classes
+from koref_relation import as_relation
+
+
+def solve_native_bb(
+    n,
+    durations,
+    probabilities,
+    precedence,
+    model_precedence=None,
+    time_limit=None,
+    incumbent=None,
+    gap=None,
+    absolute_gap=None,
+    symmetry_breaking=True,
+):
+    """
+    Depth-first branch-and-bound over the linear extensions of model_precedence.
+
+    The gap targets are checked against the live bound of the linear
+    extensions, but the returned bound is the root bound over all refinements.
+
+    Args:
+        n: Number of activities
+        durations: List of durations
+        probabilities: List of KO probabilities
+        precedence: Input PrecedenceRelation (baseline and lower bound)
+        model_precedence: Relation to search (e.g. after koref_preprocess.preprocess);
+            defaults to precedence
+        time_limit: Time limit in seconds
+        incumbent: Optional (refined_precedence, expected_makespan) to beat
+        gap, absolute_gap: Gap targets as in solve()
+        symmetry_breaking: Order interchangeable activities by index
+
+    Returns:
+        The same (precedence, cost, bound, is_optimal, is_timeout) tuple as solve()
+    """
+    start_time = time.perf_counter()
+    precedence = as_relation(precedence, n)
+    if model_precedence is None:
+        model_precedence = precedence
+    model_precedence = as_relation(model_precedence, n)
+
+    root_bound, best_precedence, best_cost, is_closed = start_search(
+        n, durations, probabilities, precedence, incumbent, gap, absolute_gap
+    )
+
+    evaluator = IncrementalEvaluator(n, durations, probabilities, model_precedence)
+    if evaluator.expected_makespan < best_cost:
+        best_precedence, best_cost = model_precedence.copy(), evaluator.expected_makespan
+        is_closed = gap_closed(best_cost, root_bound, gap, absolute_gap)
+
+    closure = evaluator.closure
+    pairs = [
+        (a, b)
+        for a in range(n)
+        for b in range(a + 1, n)
+        if not closure.reaches(a, b) and not closure.reaches(b, a)
+    ]
+    symmetric_class = [None] * n
+    if symmetry_breaking:
+        symmetric_class = class_index(
+            interchangeable_classes(n, durations, probabilities, model_precedence), n
+        )
+
+    def branch(position):
+        """
+        Next undecided pair from position on and its orientations.
+
+        Options are popped from the end, so the orientation that leaves the
+        schedule unchanged (if any) is tried first.
+        """
+        while position < len(pairs):
+            a, b = pairs[position]
+            if not closure.reaches(a, b) and not closure.reaches(b, a):
+                break
+            position += 1
+        else:
+            return position, None
+        options = [(a, b)]
+        if symmetric_class[a] is None or symmetric_class[a] != symmetric_class[b]:
+            options.append((b, a))
+            if evaluator.is_noop(a, b):
+                options.reverse()
+        return position, options
+
+    def live_bound():
+        """Lower bound on every refinement not explored yet (best_cost if none)."""
+        # Bounds grow with depth, so the first frame with options has the smallest
+        for _, options, node_bound in stack:
+            if options:
+                return min(node_bound, best_cost)
+        return best_cost
+
+    decisions = []
+    stack = [branch(0) + (lower_bound_from_starts(evaluator.starts, durations, probabilities),)]
+    if stack[0][1] is None:
+        stack = []
+    # The model's own bound may already close the gap
+    is_closed = is_closed or gap_closed(best_cost, live_bound(), gap, absolute_gap)
+    node_count = 0
+    pruned_count = 0
+    leaf_count = 0
+    max_depth = 0
+
+    while stack and not is_closed:
+        position, options, _ = stack[-1]
+        if not options:
+            stack.pop()
+            if decisions:
+                decisions.pop()
+                evaluator.undo()
+            continue
+
+        node_count += 1
+        if node_count % TIME_CHECK_INTERVAL == 0:
+            if time_limit is not None and time.perf_counter() - start_time > time_limit:
+                print(f"\nTimeout reached after {time.perf_counter() - start_time:.1f}s")
+                break
+            # Exhausted subtrees may have raised the live bound
+            if gap_closed(best_cost, live_bound(), gap, absolute_gap):
+                print("  Gap target reached")
+                is_closed = True
+                break
+
+        a, b = options.pop()
+        evaluator.add_edge(a, b)
+        decisions.append((a, b))
+        bound = lower_bound_from_starts(evaluator.starts, durations, probabilities)
+        if best_cost <= bound:
+            pruned_count += 1
+            decisions.pop()
+            evaluator.undo()
+            continue
+
+        value = evaluator.expected_makespan
+        is_improved = value < best_cost
+        if is_improved:
+            best_cost = value
+            best_precedence = model_precedence.copy()
+            for u, v in decisions:
+                best_precedence.add(u, v)
+            print(f"  *** New best: makespan = {best_cost:.6f} (depth {len(decisions)}) ***")
+
+        next_position, next_options = branch(position + 1)
+        if next_options is None:
+            leaf_count += 1
+            decisions.pop()
+            evaluator.undo()
+        else:
+            stack.append((next_position, next_options, bound))
+            max_depth = max(max_depth, len(stack))
+        if is_improved:
+            is_closed = gap_closed(best_cost, live_bound(), gap, absolute_gap)
+            if is_closed:
+                print("  Gap target reached")
+
+    print(f"\nExplored {node_count} nodes ({leaf_count} complete refinements, "
+          f"{pruned_count} pruned), maximum depth {max_depth} of {len(pairs)} pairs")
+
+    is_exhausted = not stack
+    if is_exhausted:
+        print("  Search exhausted: no linear extension beats the result")
+    return search_result(
+        best_precedence, best_cost, root_bound, not is_exhausted and not is_closed, start_time
+    )
@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+"""
+Chain refinements (linear extensions) of KORef instances.
+
+In a chain the activities run one after another, so no two intervals
+overlap and every activity aborts at its own finish. The expected makespan
+then has a closed form: with the chain a_1, ..., a_n,
+
+    E = sum_k d_{a_k} * prod_{j < k} (1 - p_{a_j})
+
+Exchanging two neighbours x, y (x first) at a position with prefix survival
+S changes E by S * (d_y p_x - d_x p_y) and leaves every other term alone,
+so walking the linear extensions by adjacent swaps updates E in O(1) per
+swap.
+
+The same exchange argument shows that without precedence constraints the
+chain sorted by p / d in decreasing order (zero durations first) is the best
+one: any other chain has neighbours whose exchange does not increase E.
+optimal_chain finds it in O(n log n); with precedence constraints it always
+runs the available activity with the largest ratio next, which is a
+heuristic.
+
+iter_linear_extensions uses the Varol-Rotem algorithm (Knuth, TAOCP
+7.2.1.2, Algorithm V), which generates every linear extension of a partial
+order exactly once using adjacent swaps only. It is not a Gray code:
+between two extensions it either moves one activity left by one place
+(a single swap) or first moves activities back to their home positions
+(several swaps). Every swap back undoes an earlier swap left, and every
+swap left yields an extension, so there are at most two swaps per
+extension on average (amortized O(1)).
+"""
+
+import time
+
+from koref_bounds import TIME_CHECK_INTERVAL, gap_closed, search_result, start_search
+from koref_preprocess import interchangeable_classes
+from koref_relation import as_relation
+from koref_warmstart import chain_relation, expected_makespan, ratio_chain
+
+# From this many activities on, the best ratio chain replaces warm_start as
+# the incumbent the solvers start from
+CHAIN_INCUMBENT_SIZE = 100
+
+
+def chain_expected_makespan(order, durations, probabilities):
+    """
+    Expected makespan of running order as a chain, in O(n).
+
+    Args:
+        order: Sequence of activities in chain order
+        durations: List of durations
+        probabilities: List of KO probabilities
+
+    Returns:
+        Expected makespan (float)
+    """
+    total = 0.0
+    survival = 1.0
+    for a in order:
+        total += survival * durations[a]
+        survival *= 1.0 - probabilities[a]
+    return total
+
+
+def chain_order(precedence, n):
+    """
+    Activities in order if precedence is a chain (a total order), else None.
+
+    In a chain, consecutive activities of the (then unique) topological
+    order are linked by a direct constraint, so this takes O(n) once the
+    relation's topological order is known.
+    """
+    relation = as_relation(precedence, n)
+    order = relation.topological_order()
+    if order is None:
+        return None
+    for a, b in zip(order, order[1:]):
+        if (a, b) not in relation:
+            return None
+    return order
+
+
+def optimal_chain(n, durations, probabilities, precedence):
+    """
+    Linear extension by decreasing p / d ratio (see the module docstring).
+
+    The best chain if precedence is empty, a heuristic otherwise.
+
+    Returns:
+        List of activities in chain order
+    """
+    return ratio_chain(n, durations, probabilities, precedence)
+
+
+def chain_incumbent(n, durations, probabilities, precedence):
+    """
+    Ratio chain as an incumbent, with the same result as warm_start.
+
+    Returns:
+        refined_precedence: The chain as a refinement of precedence
+        expected_makespan: Its expected makespan
+        source: "ratio chain"
+        elapsed: Seconds it took
+    """
+    start_time = time.perf_counter()
+    order = optimal_chain(n, durations, probabilities, precedence)
+    relation = chain_relation(order, n, precedence)
+    cost = chain_expected_makespan(order, durations, probabilities)
+    return relation, cost, "ratio chain", time.perf_counter() - start_time
+
+
+def iter_linear_extensions(n, durations, probabilities, precedence):
+    """
+    Yield every linear extension of precedence once, by adjacent swaps.
+
+    Consecutive extensions can differ by several swaps (see the module
+    docstring), but there are amortized O(1) swaps per extension, and the
+    expected makespan is updated in O(1) per swap. Values are
+    accumulated from differences, so callers that keep one should recompute
+    it with chain_expected_makespan.
+
+    The yielded order is a live view of the search state and is only valid
+    until the next linear extension is requested.
+
+    Args:
+        n: Number of activities
+        durations: List of durations
+        probabilities: List of KO probabilities
+        precedence: Acyclic PrecedenceRelation (or dict) of constraints (a, b)
+
+    Yields:
+        order: List of the activities in chain order
+        expected_makespan: Its expected makespan
+    """
+    relation = as_relation(precedence, n)
+    if n == 0:
+        yield [], 0.0
+        return
+
+    # Algorithm V needs labels 1..n with x < y for every constraint x < y,
+    # and a[0] = 0 as a sentinel that precedes everything
+    activity = [None] + relation.topological_order()
+    label = [0] * n
+    for k in range(1, n + 1):
+        label[activity[k]] = k
+    closure = relation.closure()
+    # before[k] has bit l if label l precedes label k
+    before = [1] * (n + 1)
+    for x in range(n):
+        row = closure.rows[x]
+        for y in range(n):
+            if (row >> y) & 1:
+                before[label[y]] |= 1 << label[x]
+
+    a = list(range(n + 1))
+    u = list(range(n + 1))
+    order = activity[1:]
+    d = [0.0] + [float(durations[activity[k]]) for k in range(1, n + 1)]
+    q = [1.0] + [1.0 - probabilities[activity[k]] for k in range(1, n + 1)]
+    p = [0.0] + [float(probabilities[activity[k]]) for k in range(1, n + 1)]
+    # S[i]: survival before position i
+    S = [1.0] * (n + 2)
+    for i in range(2, n + 2):
+        S[i] = S[i - 1] * q[a[i - 1]]
+    value = sum(d[a[i]] * S[i] for i in range(1, n + 1))
+
+    def swap(i):
+        """Exchange positions i and i + 1."""
+        nonlocal value
+        x, y = a[i], a[i + 1]
+        value += S[i] * (d[y] * p[x] - d[x] * p[y])
+        S[i + 1] = S[i] * q[y]
+        a[i], a[i + 1] = y, x
+        u[x], u[y] = i + 1, i
+        order[i - 1], order[i] = order[i], order[i - 1]
+
+    yield order, value
+    k = n
+    while k > 0:
+        j = u[k]
+        l = a[j - 1]
+        if not (before[k] >> l) & 1:
+            # V4: move k one place to the left
+            swap(j - 1)
+            yield order, value
+            k = n
+            continue
+        # V5: move k back to position k
+        while j < k:
+            swap(j)
+            j += 1
+        k -= 1
+
+
+def solve_chains(
+    n,
+    durations,
+    probabilities,
+    precedence,
+    model_precedence=None,
+    time_limit=None,
+    incumbent=None,
+    gap=None,
+    absolute_gap=None,
+    symmetry_breaking=True,
+):
+    """
+    Best chain refinement by exhaustive enumeration of the linear extensions.
+
+    The best chain can still be beaten by a partial order that lets
+    activities overlap, so is_optimal is only set when the root bound is met.
+
+    Completes within seconds for about 10 activities (fewer with many
+    unordered pairs); beyond that, a time-limited run still returns the
+    best chain seen, an upper bound on the optimum. Nothing is pruned, so
+    only a gap target against the root relaxation stops the search early.
+
+    Args:
+        n: Number of activities
+        durations: List of durations
+        probabilities: List of KO probabilities
+        precedence: Input PrecedenceRelation (baseline and lower bound)
+        model_precedence: Relation whose linear extensions are enumerated
+            (e.g. after koref_preprocess.preprocess); defaults to precedence
+        time_limit: Time limit in seconds
+        incumbent: Optional (refined_precedence, expected_makespan) to beat
+        gap, absolute_gap: Gap targets as in solve()
+        symmetry_breaking: Order interchangeable activities by index
+
+    Returns:
+        The same (precedence, cost, bound, is_optimal, is_timeout) tuple as solve()
+    """
+    start_time = time.perf_counter()
+    precedence = as_relation(precedence, n)
+    if model_precedence is None:
+        model_precedence = precedence
+    relation = as_relation(model_precedence, n).copy()
+    if symmetry_breaking:
+        # Interchangeable activities can be relabelled along any chain
+        for members in interchangeable_classes(n, durations, probabilities, relation):
+            for a, b in zip(members, members[1:]):
+                relation.add(a, b)
+
+    root_bound, best_precedence, best_cost, is_closed = start_search(
+        n, durations, probabilities, precedence, incumbent, gap, absolute_gap
+    )
+
+    best_order = None
+    best_chain = None
+    extension_count = 0
+    is_timeout = False
+    if not is_closed:
+        for order, value in iter_linear_extensions(n, durations, probabilities, relation):
+            extension_count += 1
+            # Differences accumulate rounding errors: recheck near ties too
+            if best_chain is None or value < best_chain + 1e-9:
+                exact = chain_expected_makespan(order, durations, probabilities)
+                if best_chain is None or exact < best_chain:
+                    best_order, best_chain = list(order), exact
+                    if exact < best_cost:
+                        print(f"  *** New best chain: makespan = {exact:.6f} ***")
+                    # Confirm with the schedule-based value the result reports
+                    if gap_closed(exact, root_bound, gap, absolute_gap) and gap_closed(
+                        expected_makespan(n, durations, probabilities, chain_relation(order, n, precedence)),
+                        root_bound,
+                        gap,
+                        absolute_gap,
+                    ):
+                        print("  Gap target reached")
+                        is_closed = True
+                        break
+            if (
+                time_limit is not None
+                and extension_count % TIME_CHECK_INTERVAL == 0
+                and time.perf_counter() - start_time > time_limit
+            ):
+                print(f"\nTimeout reached after {time.perf_counter() - start_time:.1f}s")
+                is_timeout = True
+                break
+
+    print(f"\nEnumerated {extension_count} linear extensions")
+    if best_order is not None:
+        label = "Best chain" if not is_timeout and not is_closed else "Best chain seen"
+        print(f"{label}: {best_chain:.6f}  ({' < '.join(map(str, best_order))})")
+        chain = chain_relation(best_order, n, precedence)
+        cost = expected_makespan(n, durations, probabilities, chain)
+        if cost < best_cost:
+            best_precedence, best_cost = chain, cost
+
+    # Exhausting the chains proves nothing about the other refinements
+    return search_result(best_precedence, best_cost, root_bound, is_timeout, start_time)
+
+
+def solve_chain(
+    n,
+    durations,
+    probabilities,
+    precedence,
+    incumbent=None,
+):
+    """
+    Chain by ratio ordering (optimal_chain), in O(n log n).
+
+    Without precedence constraints it is the best chain, but a partial order
+    that lets activities overlap can still do better, so is_optimal is only
+    set when the lower bound is met.
+
+    Args:
+        n: Number of activities
+        durations: List of durations
+        probabilities: List of KO probabilities
+        precedence: Acyclic PrecedenceRelation (or dict) of constraints (a, b)
+        incumbent: Optional (refined_precedence, expected_makespan) to beat
+
+    Returns:
+        The same (precedence, cost, bound, is_optimal, is_timeout) tuple as solve()
+    """
+    start_time = time.perf_counter()
+    precedence = as_relation(precedence, n)
+    root_bound, best_precedence, best_cost, _ = start_search(
+        n, durations, probabilities, precedence, incumbent
+    )
+
+    order = optimal_chain(n, durations, probabilities, precedence)
+    chain = chain_relation(order, n, precedence)
+    cost = chain_expected_makespan(order, durations, probabilities)
+    label = "Best chain" if not precedence else "Ratio chain"
+    print(f"{label}: {cost:.6f}  ({' < '.join(map(str, order))})")
+    if cost < best_cost:
+        best_precedence, best_cost = chain, cost
+
+    return search_result(best_precedence, best_cost, root_bound, False, start_time)
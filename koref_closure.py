@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+Bitset-based reachability for KORef precedence relations.
+
+Each activity owns one Python int whose bit j is set when the activity
+precedes j (transitively). Row operations work on whole machine words, so the
+closure costs O(n^2) bitset operations of n/64 words each instead of O(n^3)
+dict lookups.
+"""
+
+
+def iter_bits(mask):
+    """Yield the indices of the set bits of mask in increasing order."""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+class BitsetClosure:
+    """
+    Transitive closure of a precedence relation stored as one bitset per activity.
+
+    rows[a] has bit b set iff a precedes b in the closure. A cycle through a
+    shows up as bit a set in rows[a].
+    """
+
+    __slots__ = ("n", "rows")
+
+    def __init__(self, n, rows):
+        self.n = n
+        self.rows = rows
+
+    @classmethod
+    def from_edges(cls, edges, n):
+        """
+        Build the closure of a list of direct edges (a, b) meaning a precedes b.
+        """
+        rows = [0] * n
+        for a, b in edges:
+            rows[a] |= 1 << b
+        close_rows(rows)
+        return cls(n, rows)
+
+    @classmethod
+    def from_precedence(cls, precedence, n):
+        """
+        Build the closure of a precedence dict mapping (a, b) -> True.
+        """
+        return cls.from_edges(
+            [pair for pair, present in precedence.items() if present], n
+        )
+
+    @classmethod
+    def from_closure_dict(cls, closure, n):
+        """
+        Wrap a dict in the format returned by compute_transitive_closure.
+
+        The dict is assumed to be transitively closed already.
+        """
+        rows = [0] * n
+        for (a, b), present in closure.items():
+            if present:
+                rows[a] |= 1 << b
+        return cls(n, rows)
+
+    def copy(self):
+        return BitsetClosure(self.n, list(self.rows))
+
+    def reaches(self, a, b):
+        """Return True if a precedes b (transitively)."""
+        return (self.rows[a] >> b) & 1 == 1
+
+    def comparable(self, a, b):
+        """Return True if a and b are ordered either way."""
+        return self.reaches(a, b) or self.reaches(b, a)
+
+    def successors(self, a):
+        """Return the list of all transitive successors of a."""
+        return list(iter_bits(self.rows[a]))
+
+    def predecessor_rows(self):
+        """Return the transposed rows: bit a of result[b] is set iff a precedes b."""
+        cols = [0] * self.n
+        for a, row in enumerate(self.rows):
+            bit = 1 << a
+            for b in iter_bits(row):
+                cols[b] |= bit
+        return cols
+
+    def is_acyclic(self):
+        """Return True if no activity precedes itself."""
+        for a, row in enumerate(self.rows):
+            if (row >> a) & 1:
+                return False
+        return True
+
+    def num_pairs(self):
+        """Number of ordered pairs (a, b) in the closure."""
+        return sum(bin(row).count("1") for row in self.rows)
+
+    def to_precedence(self):
+        """Return the closure as a sparse precedence dict {(a, b): True}."""
+        return {(a, b): True for a, row in enumerate(self.rows) for b in iter_bits(row)}
+
+    def to_dict(self):
+        """
+        Return the closure in the dense format of compute_transitive_closure.
+
+        Every ordered pair (a, b) with a != b is a key mapping to a bool.
+        """
+        n = self.n
+        closure = {}
+        for a in range(n):
+            row = self.rows[a]
+            for b in range(n):
+                if a != b:
+                    closure[(a, b)] = (row >> b) & 1 == 1
+        return closure
+
+    def __eq__(self, other):
+        if not isinstance(other, BitsetClosure):
+            return NotImplemented
+        return self.n == other.n and self.rows == other.rows
+
+    def __repr__(self):
+        return f"BitsetClosure(n={self.n}, pairs={self.num_pairs()})"
+
+
+class IncrementalClosure:
+    """
+    Transitive closure maintained under single-edge insertion with undo.
+
+    Keeps successor bitsets (rows) and predecessor bitsets (cols). Inserting
+    a < b only touches the ancestors of a and the descendants of b; the
+    overwritten bitsets are pushed on an undo stack so depth-first search can
+    backtrack without recomputing the closure.
+    """
+
+    __slots__ = ("n", "rows", "cols", "_undo")
+
+    def __init__(self, closure):
+        """
+        Args:
+            closure: Acyclic BitsetClosure to start from (copied)
+        """
+        self.n = closure.n
+        self.rows = list(closure.rows)
+        self.cols = closure.predecessor_rows()
+        self._undo = []
+
+    @classmethod
+    def from_precedence(cls, precedence, n):
+        return cls(BitsetClosure.from_precedence(precedence, n))
+
+    def reaches(self, a, b):
+        """Return True if a precedes b (transitively)."""
+        return (self.rows[a] >> b) & 1 == 1
+
+    def creates_cycle(self, a, b):
+        """Return True if adding a < b would close a cycle (O(1))."""
+        return a == b or (self.rows[b] >> a) & 1 == 1
+
+    def add_edge(self, a, b):
+        """
+        Add a < b and close transitively.
+
+        Returns:
+            False (and leaves the closure unchanged) if the edge would create
+            a cycle, True otherwise. Every accepted call pushes exactly one
+            undo record, including edges already implied by the closure.
+        """
+        if self.creates_cycle(a, b):
+            return False
+
+        if (self.rows[a] >> b) & 1:
+            self._undo.append(None)
+            return True
+
+        rows = self.rows
+        cols = self.cols
+        ancestors = cols[a] | (1 << a)
+        descendants = rows[b] | (1 << b)
+
+        saved_rows = []
+        for x in iter_bits(ancestors):
+            row = rows[x]
+            if descendants & ~row:
+                saved_rows.append((x, row))
+                rows[x] = row | descendants
+
+        saved_cols = []
+        for y in iter_bits(descendants):
+            col = cols[y]
+            if ancestors & ~col:
+                saved_cols.append((y, col))
+                cols[y] = col | ancestors
+
+        self._undo.append((saved_rows, saved_cols))
+        return True
+
+    def undo(self):
+        """Revert the most recent accepted add_edge."""
+        record = self._undo.pop()
+        if record is None:
+            return
+        saved_rows, saved_cols = record
+        for x, row in saved_rows:
+            self.rows[x] = row
+        for y, col in saved_cols:
+            self.cols[y] = col
+
+    def depth(self):
+        """Number of accepted insertions that can be undone."""
+        return len(self._undo)
+
+    def undo_to(self, depth):
+        """Undo insertions until only depth of them remain."""
+        while len(self._undo) > depth:
+            self.undo()
+
+    def snapshot(self):
+        """Return the current closure as an independent BitsetClosure."""
+        return BitsetClosure(self.n, list(self.rows))
+
+
+def close_rows(rows):
+    """
+    Transitively close a list of adjacency bitsets in place (bitset Warshall).
+    """
+    for k, row_k in enumerate(rows):
+        bit = 1 << k
+        for i, row_i in enumerate(rows):
+            if row_i & bit:
+                rows[i] = row_i | row_k
+    return rows
@@ -4,22 +4,45 @@ DIDP model for KO-plan Refinement (KORef) problem.
 """
 
 import argparse
+import math
 import time
 
 import didppy as dp
 import read_koref
+from koref_bounds import gap_closed, lower_bound, optimality_gap, relaxation_dual_bound
+from koref_branch_bound import solve_native_bb
+from koref_chain import (
+    CHAIN_INCUMBENT_SIZE,
+    chain_expected_makespan,
+    chain_incumbent,
+    chain_order,
+    solve_chain,
+    solve_chains,
+)
+from koref_closure import IncrementalClosure
+from koref_enumerate import solve_enumerate, solve_gray
+from koref_evaluator import TerminalCostCache, is_schedule_canonical, schedule_signature
+from koref_kernel import kernelize, report_kernel
+from koref_parallel import solve_parallel
+from koref_preprocess import class_index, interchangeable_classes, preprocess, symmetry_factor
+from koref_relation import as_relation
 from koref_utils import (
-    check_acyclic,
     compute_earliest_start_schedule,
-    compute_expected_makespan,
-    compute_transitive_closure,
+    compute_expected_makespan_fast,
 )
+from koref_warmstart import WARM_START_TIME_LIMIT, warm_start
 
 start = time.perf_counter()
 
 # Scale factor for converting floats to integers (for expected makespan)
 SCALE_FACTOR = 1000000
 
+# Duration levels of the stage model's relaxation dual bound
+STAGE_BOUND_LEVELS = 4
+
+# Largest cost a DIDP integer-cost model can hold (32-bit signed)
+INT_COST_LIMIT = 2**31 - 1
+
 
 def encode_pair(a, b, n):
     """Encode pair (a, b) as an integer index."""
@@ -53,7 +76,46 @@ def decode_pair(idx, n):
         return (a, b)
 
 
-def create_model(n, durations, probabilities, precedence):
+def ordered_pair_index(a, b, n):
+    """Index of the ordered pair (a, b), a != b, in row-major order without the diagonal."""
+    return a * (n - 1) + (b - 1 if b > a else b)
+
+
+def ordered_pair_from_index(idx, n):
+    """Inverse of ordered_pair_index."""
+    a, offset = divmod(idx, n - 1)
+    return (a, offset + 1 if offset >= a else offset)
+
+
+class PairIndex(dict):
+    """
+    Dict mapping ordered pair index -> (a, b), as returned by create_model.
+    
+    Also carries the structured transition metadata: transitions maps each
+    transition name to the pair (a, b) it adds, so solutions can be mapped
+    back to constraints without parsing names. partial_terminals is True if
+    terminal states may leave pairs unordered (create_transitive_model); in
+    create_model every terminal is a linear extension.
+    """
+    
+    __slots__ = ("n", "transitions", "partial_terminals")
+    
+    def __init__(self, n):
+        super().__init__(
+            (ordered_pair_index(a, b, n), (a, b))
+            for a in range(n)
+            for b in range(n)
+            if a != b
+        )
+        self.n = n
+        self.transitions = {}
+        self.partial_terminals = False
+    
+    def index(self, a, b):
+        return ordered_pair_index(a, b, self.n)
+
+
+def create_model(n, durations, probabilities, precedence, symmetry_breaking=True):
     """
     Create a DIDP model for KORef.
     
@@ -61,18 +123,30 @@ def create_model(n, durations, probabilities, precedence):
     we have a complete refinement. The actual expected makespan is computed
     post-solution by reconstructing the precedence relation.
     
+    Pair indices are computed arithmetically (ordered_pair_index), so building
+    the model is O(n^2) instead of searching all pairs for every unordered pair.
+    
+    With symmetry_breaking, two interchangeable activities (koref_preprocess.
+    interchangeable_classes) can only be ordered by index, so one linear
+    extension per symmetric class is explored.
+    
     Args:
         n: Number of activities
         durations: List of durations
         probabilities: List of KO probabilities  
-        precedence: Dict mapping (a, b) -> True if a precedes b (original)
+        precedence: PrecedenceRelation (or dict) of original constraints (a, b)
+        symmetry_breaking: Order interchangeable activities by index
     
     Returns:
         model: DIDP model
-        pair_to_info: Dict mapping pair index -> (a, b)
+        pair_to_info: PairIndex mapping pair index -> (a, b), with transition metadata
         initial_precedence: Original precedence relation
+        unresolved_pair_map: Dict mapping unresolved (a, b), a < b -> (pidx_ab, pidx_ba)
+        duration_table: DIDP float table of durations
+        prob_table: DIDP float table of KO probabilities
     """
     model = dp.Model()
+    precedence = as_relation(precedence, n)
     
     # Object types
     activity = model.add_object_type(number=n)
@@ -80,59 +154,32 @@ def create_model(n, durations, probabilities, precedence):
     num_pairs = n * (n - 1)
     pair = model.add_object_type(number=num_pairs)
     
-    # Build mapping from pair index to (a, b)
-    pair_to_info = {}
-    pair_idx = 0
-    for a in range(n):
-        for b in range(n):
-            if a != b:
-                pair_to_info[pair_idx] = (a, b)
-                pair_idx += 1
+    # Mapping from pair index to (a, b)
+    pair_to_info = PairIndex(n)
     
     # Compute initial unresolved pairs U
     # U contains unordered pairs {a,b} where neither a<b nor b<a is determined
-    # We'll track them by storing one canonical pair index per unordered pair
-    initial_precedence_closure = compute_transitive_closure(precedence, n)
+    # We track them by storing one canonical pair index (a, b), a < b, per unordered pair
+    closure_rows = precedence.closure().rows
     unresolved_pairs_list = []
     unresolved_pair_map = {}  # Maps unordered pair (min(a,b), max(a,b)) -> pair indices
     
-    # Build mapping: for each unordered pair, find both ordered pair indices
     for a in range(n):
-        for b in range(a + 1, n):  # Only consider a < b to avoid duplicates
-            has_a_prec_b = initial_precedence_closure.get((a, b), False)
-            has_b_prec_a = initial_precedence_closure.get((b, a), False)
-            if not has_a_prec_b and not has_b_prec_a:
-                # Find pair indices for (a,b) and (b,a)
-                pidx_ab = None
-                pidx_ba = None
-                for pidx in range(num_pairs):
-                    if pair_to_info[pidx] == (a, b):
-                        pidx_ab = pidx
-                    elif pair_to_info[pidx] == (b, a):
-                        pidx_ba = pidx
-                if pidx_ab is not None and pidx_ba is not None:
-                    unresolved_pairs_list.append(pidx_ab)  # Use (a,b) as canonical
-                    unresolved_pair_map[(a, b)] = (pidx_ab, pidx_ba)
+        row_a = closure_rows[a]
+        for b in range(a + 1, n):
+            if not (row_a >> b) & 1 and not (closure_rows[b] >> a) & 1:
+                pidx_ab = ordered_pair_index(a, b, n)
+                pidx_ba = ordered_pair_index(b, a, n)
+                unresolved_pairs_list.append(pidx_ab)  # Use (a,b) as canonical
+                unresolved_pair_map[(a, b)] = (pidx_ab, pidx_ba)
     
     # State variables
     unresolved = model.add_set_var(object_type=pair, target=unresolved_pairs_list)
     
     # Track added precedence constraints: set of pair indices representing added constraints
-    # We'll use a set variable to track which constraints have been added
     # For each added constraint (a,b), we store the pair index for (a,b)
     added_constraints = model.add_set_var(object_type=pair, target=[])
     
-    # Tables for initial precedence relation (read-only, for cycle checking)
-    precedence_table_data = []
-    for a in range(n):
-        for b in range(n):
-            if initial_precedence_closure.get((a, b), False):
-                precedence_table_data.append(1)
-            else:
-                precedence_table_data.append(0)
-    
-    precedence_table = model.add_int_table(precedence_table_data)
-    
     # Tables for durations and probabilities (needed for cost computation)
     duration_table = model.add_float_table(durations)
     prob_table = model.add_float_table(probabilities)
@@ -141,107 +188,280 @@ def create_model(n, durations, probabilities, precedence):
     pair_to_a = model.add_int_table([pair_to_info[i][0] for i in range(num_pairs)])
     pair_to_b = model.add_int_table([pair_to_info[i][1] for i in range(num_pairs)])
     
-    # Base case: Allow both complete refinements (all pairs resolved) and partial refinements
-    # We accept as terminal:
-    # 1. States where all pairs are resolved (complete refinements)
-    # 2. States where at least one constraint was added (partial refinements)
+    # Base case: only complete refinements (all pairs resolved) are terminal.
     # 
     # Note: Terminal cost cannot be expressed directly in DIDP since it requires
     # reconstructing precedence and computing expected makespan (complex algorithm).
-    # We'll compute costs post-search. DFBB will still use branch & bound techniques
-    # but costs are evaluated after reaching terminal states.
+    # We'll compute costs post-search.
     # 
     # For minimization: cost=None means cost is 0, actual cost computed post-search
-    # Only complete refinements are terminal (all pairs resolved)
     model.add_base_case([unresolved.is_empty()], cost=None)
     
-    # Note: We removed the partial refinement base case (added_constraints.len() > 0)
-    # because it caused premature termination - the solver would stop after adding
-    # just one constraint instead of exploring the full state space.
-    
     # Transitions: for each unresolved unordered pair {a,b}, we can add either a<b or b<a
     # When we add a constraint, we remove the canonical pair index from unresolved
     # and add the constraint to added_constraints
     
+    symmetric_class = [None] * n
+    if symmetry_breaking:
+        symmetric_class = class_index(
+            interchangeable_classes(n, durations, probabilities, precedence), n
+        )
+    
+    # Unresolved pairs are incomparable in the initial closure, so no
+    # precondition on the initial precedence is needed.
     for (a, b), (pidx_ab, pidx_ba) in unresolved_pair_map.items():
-        idx_ab = a * n + b
-        idx_ba = b * n + a
+        # Transition: add a < b
+        name_ab = f"add_precedence_{a}_before_{b}"
+        add_a_prec_b = dp.Transition(
+            name=name_ab,
+            cost=0,  # Zero cost - actual cost computed at terminal state
+            effects=[
+                (unresolved, unresolved.remove(pidx_ab)),
+                (added_constraints, added_constraints.add(pidx_ab)),
+            ],
+            preconditions=[unresolved.contains(pidx_ab)],
+        )
+        model.add_transition(add_a_prec_b)
+        pair_to_info.transitions[name_ab] = (a, b)
         
-        # Find the pair index for (a,b) constraint
-        constraint_idx_ab = None
-        constraint_idx_ba = None
-        for pidx in range(num_pairs):
-            if pair_to_info[pidx] == (a, b):
-                constraint_idx_ab = pidx
-            elif pair_to_info[pidx] == (b, a):
-                constraint_idx_ba = pidx
+        if symmetric_class[a] is not None and symmetric_class[a] == symmetric_class[b]:
+            continue  # Interchangeable: a < b is the canonical order
         
-        # Transition: add a < b
-        if constraint_idx_ab is not None:
-            add_a_prec_b = dp.Transition(
-                name=f"add_precedence_{a}_before_{b}",
-                cost=0,  # Zero cost - actual cost computed at terminal state
+        # Transition: add b < a
+        name_ba = f"add_precedence_{b}_before_{a}"
+        add_b_prec_a = dp.Transition(
+            name=name_ba,
+            cost=0,  # Zero cost - actual cost computed at terminal state
+            effects=[
+                (unresolved, unresolved.remove(pidx_ab)),
+                (added_constraints, added_constraints.add(pidx_ba)),
+            ],
+            preconditions=[unresolved.contains(pidx_ab)],
+        )
+        model.add_transition(add_b_prec_a)
+        pair_to_info.transitions[name_ba] = (b, a)
+    
+    return model, pair_to_info, precedence, unresolved_pair_map, duration_table, prob_table
+
+
+def create_transitive_model(n, durations, probabilities, precedence, symmetry_breaking=True):
+    """
+    Create a transitivity-aware DIDP model for KORef.
+    
+    Each activity has a successor set, a predecessor set and a set of
+    activities declared parallel (incomparable) to it. The initially unresolved
+    pairs are visited in a fixed order through a cursor; the current pair is
+    either ordered a < b, ordered b < a, declared parallel, or skipped if
+    earlier decisions already ordered it transitively. Adding a < b adds the
+    descendants of b to every ancestor of a and vice versa, so all implied
+    pairs are resolved at once. An unresolved pair cannot close a cycle, and a
+    precondition forbids ordering two activities declared parallel, so every
+    terminal state is a distinct partial order extending the input.
+    
+    The model has O(n) effects and preconditions per transition (O(n^3) in
+    total) and is meant for small and medium instances. It returns the same
+    tuple as create_model, so solve() works with it unchanged.
+    
+    With symmetry_breaking, interchangeable activities are never ordered
+    against their index order directly (they may still be left parallel).
+    
+    Args:
+        n: Number of activities
+        durations: List of durations
+        probabilities: List of KO probabilities
+        precedence: PrecedenceRelation (or dict) of original constraints (a, b)
+        symmetry_breaking: Order interchangeable activities by index
+    
+    Returns:
+        Same tuple as create_model
+    """
+    model = dp.Model()
+    precedence = as_relation(precedence, n)
+    closure = precedence.closure()
+    
+    activity = model.add_object_type(number=n)
+    
+    pair_to_info = PairIndex(n)
+    pair_to_info.partial_terminals = True
+    unresolved_pair_map = {}
+    for a in range(n):
+        for b in range(a + 1, n):
+            if not closure.comparable(a, b):
+                unresolved_pair_map[(a, b)] = (
+                    ordered_pair_index(a, b, n),
+                    ordered_pair_index(b, a, n),
+                )
+    
+    # State variables
+    pred_rows = closure.predecessor_rows()
+    succ = [
+        model.add_set_var(object_type=activity, target=closure.successors(a))
+        for a in range(n)
+    ]
+    pred = [
+        model.add_set_var(object_type=activity, target=[x for x in range(n) if (pred_rows[a] >> x) & 1])
+        for a in range(n)
+    ]
+    parallel = [model.add_set_var(object_type=activity, target=[]) for _ in range(n)]
+    cursor = model.add_int_var(target=0)
+    
+    duration_table = model.add_float_table(durations)
+    prob_table = model.add_float_table(probabilities)
+    
+    model.add_base_case([cursor == len(unresolved_pair_map)])
+    
+    def order_transition(a, b, k):
+        """Transition adding a < b (and everything it implies) for pair k."""
+        ancestors = pred[a].add(a)
+        descendants = succ[b].add(b)
+        effects = [(cursor, cursor + 1)]
+        for x in range(n):
+            if x == a:
+                effects.append((succ[x], succ[x] | descendants))
+            else:
+                effects.append(
+                    (succ[x], pred[a].contains(x).if_then_else(succ[x] | descendants, succ[x]))
+                )
+            if x == b:
+                effects.append((pred[x], pred[x] | ancestors))
+            else:
+                effects.append(
+                    (pred[x], succ[b].contains(x).if_then_else(pred[x] | ancestors, pred[x]))
+                )
+        
+        preconditions = [
+            cursor == k,
+            ~succ[a].contains(b),
+            ~succ[b].contains(a),  # b < a would make a < b cyclic
+        ]
+        # No ancestor of a may have been declared parallel to a descendant of b
+        for u in range(n):
+            compatible = (parallel[u] & descendants).is_empty()
+            if u == a:
+                preconditions.append(compatible)
+            else:
+                preconditions.append(~pred[a].contains(u) | compatible)
+        
+        name = f"add_precedence_{a}_before_{b}"
+        pair_to_info.transitions[name] = (a, b)
+        return dp.Transition(name=name, cost=0, effects=effects, preconditions=preconditions)
+    
+    symmetric_class = [None] * n
+    if symmetry_breaking:
+        symmetric_class = class_index(
+            interchangeable_classes(n, durations, probabilities, precedence), n
+        )
+    
+    for k, (a, b) in enumerate(unresolved_pair_map):
+        model.add_transition(order_transition(a, b, k))
+        if symmetric_class[a] is None or symmetric_class[a] != symmetric_class[b]:
+            model.add_transition(order_transition(b, a, k))
+        
+        model.add_transition(
+            dp.Transition(
+                name=f"parallel_{a}_{b}",
+                cost=0,
                 effects=[
-                    (unresolved, unresolved.remove(pidx_ab)),
-                    (added_constraints, added_constraints.add(constraint_idx_ab)),
+                    (cursor, cursor + 1),
+                    (parallel[a], parallel[a].add(b)),
+                    (parallel[b], parallel[b].add(a)),
                 ],
                 preconditions=[
-                    unresolved.contains(pidx_ab),
-                    precedence_table[idx_ba] == 0,  # b does not precede a initially
-                    # Check that adding this doesn't create a cycle with already added constraints
-                    # (We'll check this more thoroughly post-solution, but basic check here)
+                    cursor == k,
+                    ~succ[a].contains(b),
+                    ~succ[b].contains(a),
                 ],
             )
-            model.add_transition(add_a_prec_b)
+        )
         
-        # Transition: add b < a
-        if constraint_idx_ba is not None:
-            add_b_prec_a = dp.Transition(
-                name=f"add_precedence_{b}_before_{a}",
-                cost=0,  # Zero cost - actual cost computed at terminal state
-                effects=[
-                    (unresolved, unresolved.remove(pidx_ab)),
-                    (added_constraints, added_constraints.add(constraint_idx_ba)),
-                ],
-                preconditions=[
-                    unresolved.contains(pidx_ab),
-                    precedence_table[idx_ab] == 0,  # a does not precede b initially
-                ],
+        # Pair already ordered by transitivity: nothing to decide
+        model.add_transition(
+            dp.Transition(
+                name=f"implied_{a}_{b}",
+                cost=0,
+                effects=[(cursor, cursor + 1)],
+                preconditions=[cursor == k, succ[a].contains(b) | succ[b].contains(a)],
             )
-            model.add_transition(add_b_prec_a)
+        )
     
     return model, pair_to_info, precedence, unresolved_pair_map, duration_table, prob_table
 
 
-def extract_precedence_from_solution(transitions, n, initial_precedence):
+def report_symmetry(n, durations, probabilities, precedence, disabled=False):
+    """Print the interchangeable classes a model was built with and the orbits they prune."""
+    classes = interchangeable_classes(n, durations, probabilities, precedence)
+    if not classes:
+        print("Symmetry breaking: no interchangeable activities")
+        return
+    
+    sizes = sorted((len(members) for members in classes), reverse=True)
+    print(
+        f"Symmetry breaking{' (disabled)' if disabled else ''}: "
+        f"{len(classes)} classes of interchangeable activities (sizes {sizes})"
+    )
+    if not disabled:
+        print(
+            f"  One refinement per orbit is explored; each orbit has up to "
+            f"{symmetry_factor(classes)} symmetric refinements, "
+            f"{symmetry_factor(classes) - 1} of them pruned"
+        )
+
+
+def transition_pair(transition, pair_to_info=None):
+    """
+    Return the constraint (a, b) added by a transition, or None.
+    
+    Uses the structured metadata in pair_to_info when available and falls back
+    to parsing "add_precedence_{a}_before_{b}" names otherwise.
+    """
+    transitions = getattr(pair_to_info, "transitions", None)
+    if transitions is not None:
+        return transitions.get(transition.name)
+    name = transition.name
+    if name.startswith("add_precedence_"):
+        parts = name.split("_")
+        return (int(parts[2]), int(parts[4]))
+    return None
+
+
+def extract_precedence_from_solution(transitions, n, initial_precedence, pair_to_info=None):
     """
     Extract the refined precedence relation from DIDP solution transitions.
     Also checks for cycles and returns None if a cycle is detected.
     """
     refined_precedence = initial_precedence.copy()
+    initial_closure = as_relation(initial_precedence, n).closure()
+    if not initial_closure.is_acyclic():
+        return None
+    closure = IncrementalClosure(initial_closure)
     
     for transition in transitions:
-        name = transition.name
-        if name.startswith("add_precedence_"):
-            # Parse: "add_precedence_{a}_before_{b}"
-            parts = name.split("_")
-            a = int(parts[2])
-            b = int(parts[4])
+        pair = transition_pair(transition, pair_to_info)
+        if pair is not None:
+            a, b = pair
+            # Reject as soon as a constraint closes a cycle with earlier ones
+            if not closure.add_edge(a, b):
+                return None
             refined_precedence[(a, b)] = True
     
-    # Check acyclicity
-    if not check_acyclic(refined_precedence, n):
-        return None
-    
     # Return the refined precedence (not transitive closure - that's computed when needed)
     return refined_precedence
 
 
-def compute_terminal_cost(refined_precedence, n, durations, probabilities):
+def compute_terminal_cost(refined_precedence, n, durations, probabilities, cache=None):
     """
     Compute the exact expected makespan for a terminal state.
     This is called for each terminal state to get the true cost.
+    
+    If a TerminalCostCache is given, refinements with an already evaluated
+    earliest-start schedule reuse the cached makespan. Chains are evaluated
+    in O(n) by koref_chain.chain_expected_makespan instead.
     """
+    # Chains have a closed form (koref_chain), no schedule needed
+    order = chain_order(refined_precedence, n)
+    if order is not None:
+        return chain_expected_makespan(order, durations, probabilities)
+    
     activities = list(range(n))
     
     # Compute schedule
@@ -249,14 +469,351 @@ def compute_terminal_cost(refined_precedence, n, durations, probabilities):
         activities, refined_precedence, durations
     )
     
-    # Compute exact expected makespan
-    expected_makespan = compute_expected_makespan(
+    if cache is not None:
+        key = schedule_signature(schedule, n)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+    
+    # Compute exact expected makespan (array kernel, same result as the reference)
+    expected_makespan = compute_expected_makespan_fast(
         activities, schedule, durations, probabilities
     )
     
+    if cache is not None:
+        cache.put(key, expected_makespan)
+    
     return expected_makespan
 
 
+def create_stage_model(
+    n, durations, probabilities, precedence, integer_costs=False, symmetry_breaking=True
+):
+    """
+    Create the sequential-construction (stage) DIDP model for KORef.
+    
+    A solution is a sequence of stages; all activities of a stage start
+    together once every activity of the previous stages has finished, i.e.
+    stage k precedes stage k+1 completely. For such a refinement the expected
+    makespan telescopes to sum_k D_k * prod_{j<k} Q_j, where D_k is the longest
+    duration in stage k and Q_j the survival probability of stage j. The state
+    tracks the survival probability before the open stage and its current
+    length, so each transition carries its exact share of the expected makespan
+    and the solvers get real primal and dual bounds.
+    
+    Zero-duration activities knock out at the start of their stage, so they are
+    only placed in stages of zero length (this loses no expected-makespan
+    value). Activities join a stage in increasing index order to avoid
+    enumerating permutations of the same stage.
+    
+    The model ranges over stage-structured refinements only. For empty initial
+    precedence these contained the optimum in exhaustive checks on n <= 5,
+    but with initial precedence staggered schedules can be strictly better.
+    
+    With integer_costs=True, costs and the dual bound are integers in units of
+    1/SCALE_FACTOR. Adding an activity costs
+    round(SCALE_FACTOR * survival * new_length) - round(SCALE_FACTOR * survival * old_length),
+    which telescopes within a stage, so the rounding error is at most half a
+    unit per stage; the dual bound is lowered by the same amount per stage
+    still to come so it stays admissible.
+    
+    With symmetry_breaking, an interchangeable activity is only scheduled
+    after the previous member of its class, so their stages follow index
+    order.
+    
+    Args:
+        n: Number of activities
+        durations: List of durations
+        probabilities: List of KO probabilities
+        precedence: PrecedenceRelation (or dict) of original constraints (a, b)
+        integer_costs: Use scaled integer costs instead of float costs
+        symmetry_breaking: Schedule interchangeable activities in index order
+    
+    Returns:
+        model: DIDP model (float costs, or integer costs in 1/SCALE_FACTOR units)
+        stage_transitions: Dict mapping transition name -> activity it adds to the
+            open stage, or None for the transition closing the stage
+    """
+    if integer_costs and SCALE_FACTOR * sum(durations) > INT_COST_LIMIT:
+        raise ValueError(
+            "expected makespans up to {} do not fit into scaled integer costs".format(sum(durations))
+        )
+    
+    model = dp.Model(float_cost=not integer_costs)
+    precedence = as_relation(precedence, n)
+    
+    activity = model.add_object_type(number=n)
+    
+    # State variables
+    unscheduled = model.add_set_var(object_type=activity, target=list(range(n)))
+    stage = model.add_set_var(object_type=activity, target=[])
+    survival = model.add_float_var(target=1.0)  # P(no KO before the open stage)
+    stage_survival = model.add_float_var(target=1.0)  # P(no KO in the open stage)
+    stage_length = model.add_float_var(target=0.0)  # Longest duration in the open stage
+    last_added = model.add_int_var(target=-1)  # Largest activity in the open stage
+    
+    duration_table = model.add_float_table(durations)
+    survival_table = model.add_float_table([1.0 - p for p in probabilities])
+    empty_stage = model.create_set_const(object_type=activity, value=[])
+    
+    model.add_base_case([unscheduled.is_empty()])
+    
+    # Previous member of each activity's interchangeable class
+    previous_twin = [None] * n
+    if symmetry_breaking:
+        for members in interchangeable_classes(n, durations, probabilities, precedence):
+            for prev, a in zip(members, members[1:]):
+                previous_twin[a] = prev
+    
+    stage_transitions = {}
+    
+    for a in range(n):
+        d_a = durations[a]
+        preconditions = [unscheduled.contains(a), last_added < a]
+        if previous_twin[a] is not None:
+            preconditions.append(~unscheduled.contains(previous_twin[a]))
+        
+        # All original predecessors must be in earlier (closed) stages
+        predecessors = precedence.predecessors(a)
+        if predecessors:
+            pred_set = model.create_set_const(object_type=activity, value=predecessors)
+            preconditions.append((unscheduled & pred_set).is_empty())
+            preconditions.append((stage & pred_set).is_empty())
+        
+        if d_a > 0:
+            preconditions.append(stage.is_empty() | (stage_length > 0.0))
+        else:
+            preconditions.append(stage_length <= 0.0)
+        
+        if integer_costs:
+            cost = (
+                dp.IntExpr.state_cost()
+                + round(SCALE_FACTOR * survival * dp.max(stage_length, d_a))
+                - round(SCALE_FACTOR * survival * stage_length)
+            )
+        else:
+            cost = dp.FloatExpr.state_cost() + survival * (dp.max(stage_length, d_a) - stage_length)
+        
+        name = f"stage_add_{a}"
+        model.add_transition(
+            dp.Transition(
+                name=name,
+                cost=cost,
+                effects=[
+                    (unscheduled, unscheduled.remove(a)),
+                    (stage, stage.add(a)),
+                    (stage_survival, stage_survival * survival_table[a]),
+                    (stage_length, dp.max(stage_length, d_a)),
+                    (last_added, a),
+                ],
+                preconditions=preconditions,
+            )
+        )
+        stage_transitions[name] = a
+    
+    model.add_transition(
+        dp.Transition(
+            name="stage_close",
+            cost=dp.IntExpr.state_cost() if integer_costs else dp.FloatExpr.state_cost(),
+            effects=[
+                (stage, empty_stage),
+                (survival, survival * stage_survival),
+                (stage_survival, 1.0),
+                (stage_length, 0.0),
+                (last_added, -1),
+            ],
+            preconditions=[~stage.is_empty(), ~unscheduled.is_empty()],
+        )
+    )
+    stage_transitions["stage_close"] = None
+    
+    # Dual bound: own-finish relaxation of the unscheduled activities measured
+    # from the start of the open stage, on a few duration levels so it stays
+    # cheap to evaluate, and never below the longest unscheduled activity
+    # running past the open stage's length. Every later time point is weighted
+    # with at least the survival after the open stage.
+    dual_bound = (
+        survival
+        * stage_survival
+        * dp.max(
+            relaxation_dual_bound(
+                model,
+                activity,
+                durations,
+                survival_table,
+                unscheduled,
+                stage_length,
+                max_levels=STAGE_BOUND_LEVELS,
+            ),
+            (~unscheduled.is_empty()).if_then_else(
+                survival_table.product(unscheduled)
+                * dp.max(duration_table.max(unscheduled) - stage_length, 0.0),
+                0.0,
+            ),
+        )
+    )
+    if integer_costs:
+        # Every stage still to come (at most one per unscheduled activity, plus
+        # the open one) may round its cost down by half a unit
+        dual_bound = dp.max(
+            math.floor(SCALE_FACTOR * dual_bound - 0.5 * (unscheduled.len() + 1)), 0
+        )
+    model.add_dual_bound(dual_bound)
+    
+    return model, stage_transitions
+
+
+def extract_stages_from_solution(transitions, stage_transitions):
+    """Return the list of stages (lists of activities) built by a stage-model solution."""
+    stages = [[]]
+    for transition in transitions:
+        a = stage_transitions[transition.name]
+        if a is None:
+            stages.append([])
+        else:
+            stages[-1].append(a)
+    return [s for s in stages if s]
+
+
+def stages_to_precedence(stages, n, initial_precedence):
+    """
+    Refinement for a stage sequence: every activity of a stage precedes every
+    activity of the next stage (the rest follows transitively).
+    """
+    refined_precedence = as_relation(initial_precedence, n).copy()
+    for current, following in zip(stages, stages[1:]):
+        for a in current:
+            for b in following:
+                refined_precedence[(a, b)] = True
+    return refined_precedence
+
+
+def solve_staged(
+    model,
+    stage_transitions,
+    n,
+    durations,
+    probabilities,
+    initial_precedence,
+    solver_name,
+    history,
+    time_limit=None,
+    seed=2023,
+    initial_beam_size=1,
+    threads=1,
+    parallel_type=0,
+    integer_costs=False,
+    incumbent=None,
+    gap=None,
+    absolute_gap=None,
+):
+    """
+    Solve the stage model from create_stage_model with a DIDP solver.
+    
+    The solver's cost is the exact expected makespan of the staged refinement;
+    it is recomputed with compute_terminal_cost and compared against the
+    original precedence, which is returned if it is better.
+    
+    An incumbent (refined_precedence, expected_makespan), e.g. from
+    koref_warmstart.warm_start, replaces the original precedence as the
+    solution to beat, and its cost is passed to the solver as primal bound.
+    If the solver then proves that no stage refinement is cheaper, the
+    incumbent is returned.
+    
+    The search stops as soon as the best cost is within gap (relative) or
+    absolute_gap of the best bound (see koref_bounds.gap_closed).
+    
+    If the model was built with integer_costs=True, the solver's cost and
+    bound are converted back from 1/SCALE_FACTOR units and the cost is
+    cross-checked against the exact value: it may differ by at most half a
+    unit per stage.
+    
+    Returns:
+        The same (precedence, cost, bound, is_optimal, is_timeout) tuple as solve().
+        The solver's bound and optimality refer to stage-structured
+        refinements, so they are only used when the initial precedence is
+        empty; otherwise the bound is koref_bounds.lower_bound.
+    """
+    original_makespan = compute_terminal_cost(initial_precedence, n, durations, probabilities)
+    print(f"Original precedence makespan: {original_makespan:.6f}")
+    
+    best_precedence, best_makespan = initial_precedence.copy(), original_makespan
+    primal_bound = None
+    if incumbent is not None and incumbent[1] < original_makespan:
+        best_precedence, best_makespan = incumbent
+        print(f"Incumbent makespan: {best_makespan:.6f}")
+        if integer_costs:
+            # An integer cost may exceed the exact makespan by half a unit per stage
+            primal_bound = math.ceil(SCALE_FACTOR * best_makespan + 0.5 * n)
+        else:
+            primal_bound = best_makespan
+    
+    unit = 1.0 / SCALE_FACTOR if integer_costs else 1.0
+    exact_bounds = len(initial_precedence) == 0
+    best_bound = lower_bound(n, durations, probabilities, initial_precedence)
+    # An integer optimum may be rounded up by half a unit per stage
+    rounding = 0.5 * unit * n if integer_costs else 0.0
+    if gap_closed(best_makespan, best_bound, gap, absolute_gap):
+        print(f"Gap closed before search: {100 * optimality_gap(best_makespan, best_bound):.2f}%")
+        return best_precedence, best_makespan, best_bound, best_makespan <= best_bound, False
+    
+    def stop(solution):
+        cost = best_makespan
+        if solution.cost is not None:
+            cost = min(cost, solution.cost * unit)
+        bound = best_bound
+        if exact_bounds and solution.best_bound is not None:
+            bound = max(bound, solution.best_bound * unit - rounding)
+        return gap_closed(cost, bound, gap, absolute_gap)
+    
+    solver = create_solver(
+        model,
+        solver_name,
+        time_limit=time_limit,
+        seed=seed,
+        initial_beam_size=initial_beam_size,
+        threads=threads,
+        parallel_type=parallel_type,
+        primal_bound=primal_bound,
+    )
+    solution = run_solver(solver, solver_name, history, stop)
+    
+    print("Search time: {}s".format(solution.time))
+    print("Expanded: {}".format(solution.expanded))
+    print("Generated: {}".format(solution.generated))
+    
+    if exact_bounds and solution.best_bound is not None:
+        best_bound = max(best_bound, solution.best_bound * unit - rounding)
+    is_optimal = solution.is_optimal and exact_bounds
+    
+    if solution.is_infeasible or solution.cost is None:
+        # Under a primal bound, infeasible means nothing beats the incumbent
+        proven = solution.is_infeasible and primal_bound is not None and exact_bounds
+        if proven:
+            best_bound = max(best_bound, best_makespan)
+        return best_precedence, best_makespan, best_bound, proven or best_makespan <= best_bound, False
+    
+    stages = extract_stages_from_solution(solution.transitions, stage_transitions)
+    refined_precedence = stages_to_precedence(stages, n, initial_precedence)
+    expected_makespan = compute_terminal_cost(refined_precedence, n, durations, probabilities)
+    model_cost = solution.cost * unit
+    print(f"Stages: {stages}")
+    print(f"Stage model cost: {model_cost:.6f}, recomputed: {expected_makespan:.6f}")
+    if integer_costs:
+        tolerance = 0.5 * unit * len(stages) + 1e-9
+        if abs(model_cost - expected_makespan) > tolerance:
+            print(
+                f"Warning: integer cost {solution.cost} differs from the exact makespan "
+                f"by more than {tolerance:.2e}"
+            )
+    
+    if best_makespan < expected_makespan:
+        return best_precedence, best_makespan, best_bound, best_makespan <= best_bound, False
+    
+    is_optimal = is_optimal or expected_makespan <= best_bound
+    return refined_precedence, expected_makespan, best_bound, is_optimal, False
+
+
 def solve_optimal_exhaustive(
     model,
     n,
@@ -360,6 +917,110 @@ def solve_optimal_exhaustive(
     )
 
 
+def create_solver(
+    model,
+    solver_name,
+    time_limit=None,
+    seed=2023,
+    initial_beam_size=1,
+    threads=1,
+    parallel_type=0,
+    primal_bound=None,
+):
+    """
+    Create the DIDP solver named solver_name for a model (CABS by default).
+    
+    primal_bound (if given) is passed to every solver that accepts one, so
+    only solutions cheaper than it are searched for.
+    """
+    if solver_name == "LNBS":
+        if parallel_type == 2:
+            parallelization_method = dp.BeamParallelizationMethod.Sbs
+        elif parallel_type == 1:
+            parallelization_method = dp.BeamParallelizationMethod.Hdbs1
+        else:
+            parallelization_method = dp.BeamParallelizationMethod.Hdbs2
+
+        solver = dp.LNBS(
+            model,
+            initial_beam_size=initial_beam_size,
+            seed=seed,
+            parallelization_method=parallelization_method,
+            threads=threads,
+            time_limit=time_limit,
+            primal_bound=primal_bound,
+            quiet=False,
+        )
+    elif solver_name == "DD-LNS":
+        solver = dp.DDLNS(model, time_limit=time_limit, quiet=False, seed=seed, primal_bound=primal_bound)
+    elif solver_name == "FR" or solver_name == "ForwardRecursion":
+        solver = dp.ForwardRecursion(model, time_limit=time_limit, quiet=False)
+    elif solver_name == "BrFS":
+        solver = dp.BreadthFirstSearch(model, time_limit=time_limit, quiet=False, primal_bound=primal_bound)
+    elif solver_name == "CAASDy":
+        solver = dp.CAASDy(model, time_limit=time_limit, quiet=False, primal_bound=primal_bound)
+    elif solver_name == "DFBB":
+        solver = dp.DFBB(model, primal_bound=primal_bound, time_limit=time_limit, quiet=False)
+    elif solver_name == "CBFS":
+        solver = dp.CBFS(model, time_limit=time_limit, quiet=False, primal_bound=primal_bound)
+    elif solver_name == "ACPS":
+        solver = dp.ACPS(model, time_limit=time_limit, quiet=False, primal_bound=primal_bound)
+    elif solver_name == "APPS":
+        solver = dp.APPS(model, time_limit=time_limit, quiet=False, primal_bound=primal_bound)
+    elif solver_name == "DBDFS":
+        solver = dp.DBDFS(model, time_limit=time_limit, quiet=False, primal_bound=primal_bound)
+    else:
+        if parallel_type == 2:
+            parallelization_method = dp.BeamParallelizationMethod.Sbs
+        elif parallel_type == 1:
+            parallelization_method = dp.BeamParallelizationMethod.Hdbs1
+        else:
+            parallelization_method = dp.BeamParallelizationMethod.Hdbs2
+
+        solver = dp.CABS(
+            model,
+            initial_beam_size=initial_beam_size,
+            threads=threads,
+            parallelization_method=parallelization_method,
+            time_limit=time_limit,
+            primal_bound=primal_bound,
+            quiet=False,
+        )
+
+    return solver
+
+
+def run_solver(solver, solver_name, history, stop=None):
+    """
+    Run a DIDP solver to completion, logging each improving cost to history.
+    
+    If given, stop is called with every intermediate solution, and the
+    search ends early as soon as it returns True.
+    
+    Returns:
+        The last solution returned by the solver
+    """
+    if solver_name == "FR" or solver_name == "ForwardRecursion":
+        solution = solver.search()
+    else:
+        with open(history, "w") as f:
+            is_terminated = False
+
+            while not is_terminated:
+                solution, is_terminated = solver.search_next()
+
+                if solution.cost is not None:
+                    f.write(
+                        "{}, {}\n".format(time.perf_counter() - start, solution.cost)
+                    )
+                    f.flush()
+
+                if stop is not None and not is_terminated and stop(solution):
+                    break
+
+    return solution
+
+
 def solve(
     model,
     pair_to_info,
@@ -377,37 +1038,100 @@ def solve(
     initial_beam_size=1,
     threads=1,
     parallel_type=0,
+    cache_size=100000,
+    original_precedence=None,
+    incumbent=None,
+    gap=None,
+    absolute_gap=None,
 ):
     """
     Solve the KORef problem using DIDP.
     
     For optimal search with exact makespan computation, use solver_name="Optimal"
     which will exhaustively explore all terminal states.
+    
+    Terminal costs are memoized by schedule signature in an LRU cache holding
+    at most cache_size entries (0 disables it).
+    
+    The pair model has zero transition costs, so the DIDP solvers' own dual
+    bounds carry no information; the returned bound is the own-finish
+    relaxation of the initial precedence (koref_bounds.lower_bound), which is
+    valid for every refinement.
+    
+    In "Optimal" mode on a model whose terminals may leave pairs unordered
+    (pair_to_info.partial_terminals), terminals that leave unordered a pair
+    their schedule already orders (koref_evaluator.is_schedule_canonical) are
+    skipped: the canonical refinement with the same schedule, and so the same
+    expected makespan, is part of the same search space. The terminals of
+    create_model are linear extensions, which are always canonical.
+    
+    If the model was built from a preprocessed relation, original_precedence
+    is the input before preprocessing: the baseline solution and the lower
+    bound refer to it (by default they refer to initial_precedence).
+    
+    An incumbent (refined_precedence, expected_makespan), e.g. from
+    koref_warmstart.warm_start, is the solution to beat in every mode and is
+    returned if the search finds nothing better. The pair model's transition
+    costs are zero, so its cost is not passed to the DIDP solvers as primal
+    bound (solve_staged does that).
+    
+    The search stops as soon as the incumbent is within gap (relative) or
+    absolute_gap of the lower bound (see koref_bounds.gap_closed). The bound
+    is the root relaxation and is not tightened during the search (BrFS
+    exposes no bounds of its open states), so without targets the search only
+    stops early if the incumbent meets it; in practice only an explicit gap
+    target ends it before it is exhausted. The returned bound gives the final
+    gap, and is_optimal is True only if the gap is zero. Exhausting a model
+    with partial terminals covers every refinement, so the bound is then the
+    result itself; exhausting create_model only rules out the other linear
+    extensions and leaves the root bound.
     """
+    if original_precedence is None:
+        original_precedence = initial_precedence
+    cache = TerminalCostCache(maxsize=cache_size)
+    root_bound = lower_bound(n, durations, probabilities, original_precedence)
+    print(f"Lower bound (own-finish relaxation): {root_bound:.6f}")
+    if incumbent is not None and gap_closed(incumbent[1], root_bound, gap, absolute_gap):
+        print(f"Gap closed before search: {100 * optimality_gap(incumbent[1], root_bound):.2f}%")
+        return incumbent[0], incumbent[1], root_bound, incumbent[1] <= root_bound, False
+    
     # For optimal exhaustive search
     if solver_name == "Optimal" or solver_name == "EXHAUSTIVE":
         # Use BreadthFirstSearch for complete exhaustive exploration
         # BFS explores all states level by level, guaranteeing we find all complete refinements
         print("Using BreadthFirstSearch (BrFS) for complete optimal search...")
         print("Note: BrFS explores ALL complete refinements (all unresolved pairs decided)")
-        print("      This guarantees finding the global optimum.")
+        if pair_to_info.partial_terminals:
+            print("      This guarantees finding the global optimum.")
+        else:
+            print("      This guarantees the best linear extension, not the global optimum.")
         
         # First evaluate original precedence as baseline
-        original_makespan = compute_terminal_cost(initial_precedence, n, durations, probabilities)
+        original_makespan = compute_terminal_cost(original_precedence, n, durations, probabilities, cache)
         print(f"Original precedence makespan: {original_makespan:.6f}")
         
         best_cost = original_makespan
-        best_precedence = initial_precedence.copy()
+        best_precedence = original_precedence.copy()
+        if incumbent is not None and incumbent[1] < best_cost:
+            best_precedence, best_cost = incumbent
+            print(f"Incumbent makespan: {best_cost:.6f}")
         best_transitions = None
         terminal_count = 1
+        equivalent_count = 0
         
-        solver = dp.BreadthFirstSearch(model, time_limit=time_limit, quiet=False)
+        # Without get_all_solutions, search_next() only returns improving
+        # solutions, and every terminal costs 0 in the DIDP model
+        solver = dp.BreadthFirstSearch(
+            model, time_limit=time_limit, get_all_solutions=True, quiet=False
+        )
         
         # BrFS.search_next() explores all solutions
         import time
         search_start_time = time.time()
         is_terminated = False
-        while not is_terminated:
+        solution = None
+        is_closed = gap_closed(best_cost, root_bound, gap, absolute_gap)
+        while not is_terminated and not is_closed:
             if time_limit and (time.time() - search_start_time) > time_limit:
                 print(f"\nTimeout reached after {time.time() - search_start_time:.1f}s")
                 break
@@ -416,17 +1140,28 @@ def solve(
             
             if not solution.is_infeasible:
                 # Extract refined precedence
-                if len(solution.transitions) == 0:
+                if len(solution.transitions) == 0 and initial_precedence is original_precedence:
                     continue  # Already evaluated original precedence
                 
                 refined_precedence = extract_precedence_from_solution(
-                    solution.transitions, n, initial_precedence
+                    solution.transitions, n, initial_precedence, pair_to_info
                 )
                 
                 if refined_precedence is not None:
+                    # A refinement with a no-op constraint left out shares its
+                    # schedule with the canonical one, which is evaluated instead
+                    if pair_to_info.partial_terminals:
+                        relation = as_relation(refined_precedence, n)
+                        schedule = compute_earliest_start_schedule(list(range(n)), relation, durations)
+                        if not is_schedule_canonical(
+                            schedule_signature(schedule, n), durations, relation.closure()
+                        ):
+                            equivalent_count += 1
+                            continue
+                    
                     # Compute exact expected makespan
                     expected_makespan = compute_terminal_cost(
-                        refined_precedence, n, durations, probabilities
+                        refined_precedence, n, durations, probabilities, cache
                     )
                     
                     terminal_count += 1
@@ -439,10 +1174,28 @@ def solve(
                         best_transitions = solution.transitions
                         improvement = original_makespan - expected_makespan
                         print(f"  *** New best: makespan = {best_cost:.6f} (improvement: {improvement:.6f}, {100*improvement/original_makespan:.1f}%) ***")
+                        is_closed = gap_closed(best_cost, root_bound, gap, absolute_gap)
+                        if is_closed:
+                            print("  Gap target reached")
+                            break
         
         print(f"\nExplored {terminal_count} complete refinements using BrFS")
-        is_optimal = is_terminated  # Only optimal if we finished exploring all states
-        is_timeout = not is_terminated
+        if pair_to_info.partial_terminals:
+            print(f"Skipped {equivalent_count} refinements sharing the schedule of another one")
+        print(f"Terminal cost cache: {cache.hits} hits, {cache.misses} misses")
+        # The solver's own time limit also ends the search with is_terminated
+        if is_terminated and solution is not None and solution.time_out:
+            is_terminated = False
+            print("\nTimeout reached inside the solver")
+        
+        # Exhausting a model of all partial orders proves best_cost optimal;
+        # exhausting the pair model only rules out the other linear extensions
+        bound = root_bound
+        if is_terminated and pair_to_info.partial_terminals:
+            bound = best_cost
+        print(f"Optimality gap: {100 * optimality_gap(best_cost, bound):.2f}%")
+        is_optimal = best_cost <= bound
+        is_timeout = not is_terminated and not is_closed
         
         if best_precedence is None:
             return None, None, None, False, True
@@ -450,8 +1203,8 @@ def solve(
         return (
             best_precedence,
             best_cost,
-            None,
-            is_optimal,  # True only if exhaustive search completed
+            bound,
+            is_optimal,  # True only if the incumbent meets the bound
             is_timeout,
         )
     
@@ -465,91 +1218,39 @@ def solve(
             return None, None, None, False, True
         
         refined_precedence = extract_precedence_from_solution(
-            solution.transitions, n, initial_precedence
+            solution.transitions, n, initial_precedence, pair_to_info
         )
         
         if refined_precedence is None:
+            if incumbent is not None:
+                return incumbent[0], incumbent[1], root_bound, False, False
             return None, None, None, False, False
         
         expected_makespan = compute_terminal_cost(
-            refined_precedence, n, durations, probabilities
+            refined_precedence, n, durations, probabilities, cache
         )
         
+        if incumbent is not None and incumbent[1] < expected_makespan:
+            return incumbent[0], incumbent[1], root_bound, False, False
+        
         return (
             refined_precedence,
             expected_makespan,
-            None,  # best_bound
+            root_bound,
             True,  # is_optimal (ForwardRecursion guarantees optimality)
             False,
         )
     
-    if solver_name == "LNBS":
-        if parallel_type == 2:
-            parallelization_method = dp.BeamParallelizationMethod.Sbs
-        elif parallel_type == 1:
-            parallelization_method = dp.BeamParallelizationMethod.Hdbs1
-        else:
-            parallelization_method = dp.BeamParallelizationMethod.Hdbs2
-
-        solver = dp.LNBS(
-            model,
-            initial_beam_size=initial_beam_size,
-            seed=seed,
-            parallelization_method=parallelization_method,
-            threads=threads,
-            time_limit=time_limit,
-            quiet=False,
-        )
-    elif solver_name == "DD-LNS":
-        solver = dp.DDLNS(model, time_limit=time_limit, quiet=False, seed=seed)
-    elif solver_name == "FR" or solver_name == "ForwardRecursion":
-        # Already handled above
-        pass
-    elif solver_name == "BrFS":
-        solver = dp.BreadthFirstSearch(model, time_limit=time_limit, quiet=False)
-    elif solver_name == "CAASDy":
-        solver = dp.CAASDy(model, time_limit=time_limit, quiet=False)
-    elif solver_name == "DFBB":
-        solver = dp.DFBB(model, time_limit=time_limit, quiet=False)
-    elif solver_name == "CBFS":
-        solver = dp.CBFS(model, time_limit=time_limit, quiet=False)
-    elif solver_name == "ACPS":
-        solver = dp.ACPS(model, time_limit=time_limit, quiet=False)
-    elif solver_name == "APPS":
-        solver = dp.APPS(model, time_limit=time_limit, quiet=False)
-    elif solver_name == "DBDFS":
-        solver = dp.DBDFS(model, time_limit=time_limit, quiet=False)
-    else:
-        if parallel_type == 2:
-            parallelization_method = dp.BeamParallelizationMethod.Sbs
-        elif parallel_type == 1:
-            parallelization_method = dp.BeamParallelizationMethod.Hdbs1
-        else:
-            parallelization_method = dp.BeamParallelizationMethod.Hdbs2
-
-        solver = dp.CABS(
-            model,
-            initial_beam_size=initial_beam_size,
-            threads=threads,
-            parallelization_method=parallelization_method,
-            time_limit=time_limit,
-            quiet=False,
-        )
-
-    if solver_name == "FR":
-        solution = solver.search()
-    else:
-        with open(history, "w") as f:
-            is_terminated = False
-
-            while not is_terminated:
-                solution, is_terminated = solver.search_next()
-
-                if solution.cost is not None:
-                    f.write(
-                        "{}, {}\n".format(time.perf_counter() - start, solution.cost)
-                    )
-                    f.flush()
+    solver = create_solver(
+        model,
+        solver_name,
+        time_limit=time_limit,
+        seed=seed,
+        initial_beam_size=initial_beam_size,
+        threads=threads,
+        parallel_type=parallel_type,
+    )
+    solution = run_solver(solver, solver_name, history)
 
     print("Search time: {}s".format(solution.time))
     print("Expanded: {}".format(solution.expanded))
@@ -560,22 +1261,27 @@ def solve(
     else:
         # Extract refined precedence from transitions
         refined_precedence = extract_precedence_from_solution(
-            solution.transitions, n, initial_precedence
+            solution.transitions, n, initial_precedence, pair_to_info
         )
         
         if refined_precedence is None:
             print("Warning: Solution contains cycles")
+            if incumbent is not None:
+                return incumbent[0], incumbent[1], root_bound, False, False
             return None, None, None, False, False
         
         # Compute exact expected makespan for this terminal state
         expected_makespan = compute_terminal_cost(
-            refined_precedence, n, durations, probabilities
+            refined_precedence, n, durations, probabilities, cache
         )
 
+        if incumbent is not None and incumbent[1] < expected_makespan:
+            return incumbent[0], incumbent[1], root_bound, False, False
+
         return (
             refined_precedence,
             expected_makespan,
-            solution.best_bound,
+            root_bound,
             solution.is_optimal,
             False,
         )
@@ -587,45 +1293,258 @@ if __name__ == "__main__":
     parser.add_argument("--time-out", default=1800, type=int)
     parser.add_argument("--history", default="history.csv", type=str)
     parser.add_argument("--config", default="Optimal", type=str, 
-                        help="Solver: 'Optimal' (exhaustive), 'FR' (ForwardRecursion), 'CABS', 'LNBS', etc.")
+                        help="Solver: 'Optimal' (exhaustive), 'FR' (ForwardRecursion), 'CABS', 'LNBS', etc. "
+                             "Prefix with 'Stage-' (e.g. 'Stage-CABS', 'Stage-DFBB') to use the stage model, "
+                             "or with 'Transitive-' (e.g. 'Transitive-Optimal') to use the transitivity-aware model. "
+                             "'NativeBB' runs a depth-first branch-and-bound in Python over the pair model's refinements, "
+                             "'Enumerate' visits every partial order refining the input once (with bound pruning), "
+                             "'Gray' evaluates every orientation of the unresolved pairs in Gray-code order, "
+                             "'AllChains' enumerates the linear extensions by adjacent swaps, "
+                             "'Chain' returns the ratio-ordered chain in O(n log n)")
     parser.add_argument("--seed", default=2023, type=int)
     parser.add_argument("--threads", default=1, type=int)
     parser.add_argument("--initial-beam-size", default=1, type=int)
     parser.add_argument("--parallel-type", default=0, type=int)
+    parser.add_argument("--cache-size", default=100000, type=int,
+                        help="Max entries in the terminal-cost LRU cache (0 disables)")
+    parser.add_argument("--integer-costs", action="store_true",
+                        help="Stage model only: use integer costs scaled by SCALE_FACTOR")
+    parser.add_argument("--no-preprocess", action="store_true",
+                        help="Pair model only: do not fix safe dominance constraints before building the model")
+    parser.add_argument("--unsafe-preprocess", action="store_true",
+                        help="Pair model only: also fix risk-ratio heuristic constraints (may lose the optimum)")
+    parser.add_argument("--no-symmetry-breaking", action="store_true",
+                        help="Explore all permutations of interchangeable activities")
+    parser.add_argument("--no-kernelize", action="store_true",
+                        help="Solve the full instance instead of its kernel (see koref_kernel)")
+    parser.add_argument("--no-warm-start", action="store_true",
+                        help="Start from the input precedence instead of a warm-start incumbent")
+    parser.add_argument("--gap", default=None, type=float,
+                        help="Stop once the relative gap to the lower bound is at most this (e.g. 0.01)")
+    parser.add_argument("--absolute-gap", default=None, type=float,
+                        help="Stop once the incumbent is within this of the lower bound")
     args = parser.parse_args()
 
     name, n, durations, probabilities, precedence = read_koref.read(args.input)
+    original_instance = (n, durations, probabilities, precedence)
     
-    model, pair_to_info, initial_precedence, unresolved_pair_map, duration_table, prob_table = create_model(
-        n, durations, probabilities, precedence
-    )
+    # Solve the kernel in place of the input and lift its solution afterwards
+    kernel = None
+    if not args.no_kernelize:
+        kernel = kernelize(n, durations, probabilities, precedence)
+        if kernel.is_trivial():
+            kernel = None
+        else:
+            report_kernel(kernel, n)
+            n, durations, probabilities, precedence = (
+                kernel.n, kernel.durations, kernel.probabilities, kernel.precedence
+            )
     
-    solution, cost, bound, is_optimal, is_infeasible = solve(
-        model,
-        pair_to_info,
-        n,
-        durations,
-        probabilities,
-        initial_precedence,
-        unresolved_pair_map,
-        duration_table,
-        prob_table,
-        args.config,
-        args.history,
-        time_limit=args.time_out,
-        seed=args.seed,
-        threads=args.threads,
-        initial_beam_size=args.initial_beam_size,
-        parallel_type=args.parallel_type,
-    )
+    incumbent = None
+    if not args.no_warm_start and n >= CHAIN_INCUMBENT_SIZE:
+        # Greedy insertion does not get far on large instances in its budget
+        incumbent_precedence, incumbent_cost, source, elapsed = chain_incumbent(
+            n, durations, probabilities, precedence
+        )
+        print(f"Warm start: {incumbent_cost:.6f} from {source} after {elapsed:.3f}s")
+        incumbent = (incumbent_precedence, incumbent_cost)
+    elif not args.no_warm_start and n > 0:
+        incumbent_precedence, incumbent_cost, source, elapsed = warm_start(
+            n,
+            durations,
+            probabilities,
+            precedence,
+            time_limit=min(WARM_START_TIME_LIMIT, 0.1 * args.time_out),
+            seed=args.seed,
+        )
+        print(f"Warm start: {incumbent_cost:.6f} from {source} after {elapsed:.3f}s")
+        incumbent = (incumbent_precedence, incumbent_cost)
+    
+    if n == 0:
+        solution, cost, bound, is_optimal, is_infeasible = {}, 0.0, 0.0, True, False
+    elif args.config.startswith("Stage"):
+        stage_solver = args.config[len("Stage"):].lstrip("-") or "CABS"
+        integer_costs = args.integer_costs
+        if integer_costs and SCALE_FACTOR * sum(durations) > INT_COST_LIMIT:
+            # Scaled costs would overflow the integer cost type
+            print(f"Warning: durations sum to {sum(durations)}, too much for integer costs "
+                  f"scaled by {SCALE_FACTOR}; using float costs")
+            integer_costs = False
+        model, stage_transitions = create_stage_model(
+            n,
+            durations,
+            probabilities,
+            precedence,
+            integer_costs=integer_costs,
+            symmetry_breaking=not args.no_symmetry_breaking,
+        )
+        report_symmetry(n, durations, probabilities, precedence, args.no_symmetry_breaking)
+        
+        solution, cost, bound, is_optimal, is_infeasible = solve_staged(
+            model,
+            stage_transitions,
+            n,
+            durations,
+            probabilities,
+            precedence,
+            stage_solver,
+            args.history,
+            time_limit=args.time_out,
+            seed=args.seed,
+            threads=args.threads,
+            initial_beam_size=args.initial_beam_size,
+            parallel_type=args.parallel_type,
+            integer_costs=integer_costs,
+            incumbent=incumbent,
+            gap=args.gap,
+            absolute_gap=args.absolute_gap,
+        )
+    else:
+        config = args.config
+        build_model = create_model
+        if config.startswith("Transitive"):
+            config = config[len("Transitive"):].lstrip("-") or "Optimal"
+            build_model = create_transitive_model
+        
+        # Dominance between twins is only safe for the linear extensions the
+        # pair model enumerates, so the other models (and the enumeration of
+        # all partial orders) start from the input
+        model_precedence = precedence
+        if build_model is create_model and config != "Enumerate" and not args.no_preprocess:
+            model_precedence, fixed = preprocess(
+                n, durations, probabilities, precedence, unsafe=args.unsafe_preprocess
+            )
+            print(f"Preprocessing fixed {len(fixed)} constraints:")
+            for a, b, reason in fixed:
+                print(f"  {a} < {b}  ({reason})")
+        
+        if config == "Chain":
+            solution, cost, bound, is_optimal, is_infeasible = solve_chain(
+                n, durations, probabilities, precedence, incumbent=incumbent
+            )
+        elif config == "Enumerate":
+            report_symmetry(n, durations, probabilities, precedence, args.no_symmetry_breaking)
+            solution, cost, bound, is_optimal, is_infeasible = solve_enumerate(
+                n,
+                durations,
+                probabilities,
+                precedence,
+                time_limit=args.time_out,
+                incumbent=incumbent,
+                gap=args.gap,
+                absolute_gap=args.absolute_gap,
+                symmetry_breaking=not args.no_symmetry_breaking,
+            )
+        elif config == "Gray":
+            report_symmetry(n, durations, probabilities, model_precedence, args.no_symmetry_breaking)
+            solution, cost, bound, is_optimal, is_infeasible = solve_gray(
+                n,
+                durations,
+                probabilities,
+                precedence,
+                model_precedence=model_precedence,
+                time_limit=args.time_out,
+                incumbent=incumbent,
+                gap=args.gap,
+                absolute_gap=args.absolute_gap,
+                symmetry_breaking=not args.no_symmetry_breaking,
+            )
+        elif config == "AllChains":
+            report_symmetry(n, durations, probabilities, model_precedence, args.no_symmetry_breaking)
+            solution, cost, bound, is_optimal, is_infeasible = solve_chains(
+                n,
+                durations,
+                probabilities,
+                precedence,
+                model_precedence=model_precedence,
+                time_limit=args.time_out,
+                incumbent=incumbent,
+                gap=args.gap,
+                absolute_gap=args.absolute_gap,
+                symmetry_breaking=not args.no_symmetry_breaking,
+            )
+        elif config == "NativeBB":
+            report_symmetry(n, durations, probabilities, model_precedence, args.no_symmetry_breaking)
+            solution, cost, bound, is_optimal, is_infeasible = solve_native_bb(
+                n,
+                durations,
+                probabilities,
+                precedence,
+                model_precedence=model_precedence,
+                time_limit=args.time_out,
+                incumbent=incumbent,
+                gap=args.gap,
+                absolute_gap=args.absolute_gap,
+                symmetry_breaking=not args.no_symmetry_breaking,
+            )
+        # Exhaustive pair-model search with several threads runs in a process pool
+        elif config == "Optimal" and build_model is create_model and args.threads > 1:
+            report_symmetry(n, durations, probabilities, model_precedence, args.no_symmetry_breaking)
+            solution, cost, bound, is_optimal, is_infeasible = solve_parallel(
+                n,
+                durations,
+                probabilities,
+                precedence,
+                model_precedence=model_precedence,
+                threads=args.threads,
+                time_limit=args.time_out,
+                incumbent=incumbent,
+                gap=args.gap,
+                absolute_gap=args.absolute_gap,
+                symmetry_breaking=not args.no_symmetry_breaking,
+                cache_size=args.cache_size,
+            )
+        else:
+            model, pair_to_info, initial_precedence, unresolved_pair_map, duration_table, prob_table = build_model(
+                n, durations, probabilities, model_precedence, symmetry_breaking=not args.no_symmetry_breaking
+            )
+            report_symmetry(n, durations, probabilities, model_precedence, args.no_symmetry_breaking)
+            
+            solution, cost, bound, is_optimal, is_infeasible = solve(
+                model,
+                pair_to_info,
+                n,
+                durations,
+                probabilities,
+                initial_precedence,
+                unresolved_pair_map,
+                duration_table,
+                prob_table,
+                config,
+                args.history,
+                time_limit=args.time_out,
+                seed=args.seed,
+                threads=args.threads,
+                initial_beam_size=args.initial_beam_size,
+                parallel_type=args.parallel_type,
+                cache_size=args.cache_size,
+                original_precedence=precedence,
+                incumbent=incumbent,
+                gap=args.gap,
+                absolute_gap=args.absolute_gap,
+            )
+
+    if kernel is not None:
+        n, durations, probabilities, precedence = original_instance
+        bound = kernel.lift_cost(bound)
+        if cost is not None:
+            # Verify the lift by recomputing the makespan on the input
+            solution = kernel.lift(solution)
+            lifted_cost = compute_terminal_cost(solution, n, durations, probabilities)
+            if abs(lifted_cost - kernel.lift_cost(cost)) > 1e-9 * max(1.0, lifted_cost):
+                print(f"Warning: lifted makespan {lifted_cost} differs from "
+                      f"the kernel's {kernel.lift_cost(cost)}")
+            cost = lifted_cost
 
-    if is_infeasible:
+    # In "Optimal" mode the last flag means a timeout, and a solution exists
+    if is_infeasible and cost is None:
         print("The problem is infeasible")
     else:
         print("best bound: {}".format(bound))
 
         if cost is not None:
             print("expected makespan: {}".format(cost))
+            print("optimality gap: {:.4%}".format(optimality_gap(cost, bound)))
             print("refined precedence constraints:")
             activities = list(range(n))
             for a in activities:
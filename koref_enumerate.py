@@ -0,0 +1,443 @@
+#!/usr/bin/env python3
+"""
+Enumeration of the partial orders that refine a precedence relation.
+
+The exhaustive DIDP paths enumerate pair-decision sequences and discard the
+cyclic ones afterwards. iter_refinements instead visits every partial order
+Q extending the input exactly once, and never builds a cyclic relation.
+
+Pairs are taken in a fixed order. At the first pair (a, b) that is neither
+ordered by the current relation C nor decided, the search branches three
+ways: add a < b, add b < a, or keep a and b incomparable for good. The
+branches are mutually exclusive, and the path to Q is forced: each branch
+follows what Q says about (a, b), so C stays a subset of Q and the leaf
+equals Q. Pairs that C already orders are skipped, since every leaf below
+orders them too.
+
+An edge that would make a pair declared incomparable comparable is rejected
+at once. Every remaining node has a leaf below it (keep all remaining pairs
+incomparable, which gives C itself), so no subtree is a dead end and the
+delay between two refinements is polynomial: at most one root-to-leaf walk
+of at most n (n - 1) / 2 decisions. This holds for the plain enumeration
+only: nodes turned down by prune and leaves skipped by canonical_only are
+not yielded, and long runs of them can lie between two yielded refinements.
+
+Symmetry breaking keeps interchangeable activities (koref_preprocess) from
+being ordered against their index. Every orbit keeps a representative: relabel
+the members of each class along a linear extension of Q restricted to it.
+
+Many refinements share one schedule: keeping a pair incomparable and adding
+a no-op orientation of it give the same schedule. With canonical_only, only
+the canonical refinement of each schedule (koref_evaluator.
+is_schedule_canonical) is yielded, so every schedule is evaluated once.
+"""
+
+import time
+
+from koref_bounds import (
+    TIME_CHECK_INTERVAL,
+    gap_closed,
+    lower_bound_from_starts,
+    search_result,
+    start_search,
+)
+from koref_closure import iter_bits
+from koref_evaluator import IncrementalEvaluator
+from koref_preprocess import class_index, interchangeable_classes
+from koref_relation import as_relation
+
+
+def iter_refinements(
+    n,
+    durations,
+    probabilities,
+    precedence,
+    symmetry_breaking=True,
+    prune=None,
+    canonical_only=False,
+):
+    """
+    Yield every partial order that refines precedence, each exactly once.
+
+    The yielded values are live views of the search state and are only valid
+    until the next refinement is requested: copy them to keep them.
+
+    Args:
+        n: Number of activities
+        durations: List of durations
+        probabilities: List of KO probabilities
+        precedence: Acyclic PrecedenceRelation (or dict) of constraints (a, b)
+        symmetry_breaking: Order interchangeable activities by index only
+        prune: Optional callable taking the IncrementalEvaluator of a node;
+            if it returns True, no refinement of that node is visited
+        canonical_only: Skip refinements that leave unordered a pair their
+            schedule orders (another yielded refinement has the same schedule)
+
+    Yields:
+        edges: List of the (a, b) constraints added to precedence
+        evaluator: IncrementalEvaluator of the refinement (schedule,
+            closure and expected_makespan)
+    """
+    relation = as_relation(precedence, n)
+    evaluator = IncrementalEvaluator(n, durations, probabilities, relation)
+    closure = evaluator.closure
+
+    pairs = [
+        (a, b)
+        for a in range(n)
+        for b in range(a + 1, n)
+        if not closure.reaches(a, b) and not closure.reaches(b, a)
+    ]
+    symmetric_class = [None] * n
+    if symmetry_breaking:
+        symmetric_class = class_index(
+            interchangeable_classes(n, durations, probabilities, relation), n
+        )
+
+    # incomparable[a] has bit b if a and b were declared incomparable
+    incomparable = [0] * n
+    edges = []
+    trail = []
+
+    def branch(position):
+        """
+        Next undecided pair from position on and its options.
+
+        Options are popped from the end: the orientation that leaves the
+        schedule unchanged (if any) is tried first, keeping the pair
+        incomparable last, so chains that give good incumbents come early.
+        """
+        while position < len(pairs):
+            a, b = pairs[position]
+            if not closure.reaches(a, b) and not closure.reaches(b, a):
+                break
+            position += 1
+        else:
+            return position, None, None
+        options = [None]
+        if symmetric_class[a] is None or symmetric_class[a] != symmetric_class[b]:
+            options.append((b, a))
+        options.append((a, b))
+        if len(options) == 3 and evaluator.is_noop(b, a):
+            options[1:] = [(a, b), (b, a)]
+        return position, options, (a, b)
+
+    def apply(option, pair):
+        """Take one option; return False (and change nothing) if it is invalid."""
+        if option is None:
+            a, b = pair
+            incomparable[a] |= 1 << b
+            incomparable[b] |= 1 << a
+            trail.append(pair)
+            return True
+        a, b = option
+        evaluator.add_edge(a, b)
+        # Only rows of a and its ancestors gained successors
+        rows = closure.rows
+        for x in iter_bits(closure.cols[a] | (1 << a)):
+            if rows[x] & incomparable[x]:
+                evaluator.undo()
+                return False
+        edges.append(option)
+        trail.append(None)
+        return True
+
+    def undo():
+        record = trail.pop()
+        if record is None:
+            edges.pop()
+            evaluator.undo()
+        else:
+            a, b = record
+            incomparable[a] &= ~(1 << b)
+            incomparable[b] &= ~(1 << a)
+
+    if prune is not None and prune(evaluator):
+        return
+    root = branch(0)
+    if root[1] is None:
+        yield edges, evaluator
+        return
+
+    stack = [root]
+    while stack:
+        position, options, pair = stack[-1]
+        if not options:
+            stack.pop()
+            if stack:
+                undo()
+            continue
+
+        option = options.pop()
+        if not apply(option, pair):
+            continue
+        if option is not None and prune is not None and prune(evaluator):
+            undo()
+            continue
+
+        frame = branch(position + 1)
+        if frame[1] is None:
+            # Only a pair kept incomparable can be ordered by the schedule alone
+            if not canonical_only or not any(incomparable) or evaluator.is_canonical():
+                yield edges, evaluator
+            undo()
+            continue
+        stack.append(frame)
+
+
+def solve_enumerate(
+    n,
+    durations,
+    probabilities,
+    precedence,
+    time_limit=None,
+    incumbent=None,
+    gap=None,
+    absolute_gap=None,
+    symmetry_breaking=True,
+):
+    """
+    Best partial order refining precedence, by enumeration with bound pruning.
+
+    Unlike the pair model, the search space is every refinement, not only the
+    linear extensions, so an exhausted search proves global optimality. Only
+    the canonical refinement of each schedule is evaluated.
+    Subtrees whose own-finish relaxation (lower_bound_from_starts) is not
+    below the incumbent are skipped. After an exhausted search the returned
+    bound is the optimum itself, so the reported gap is zero. Gap targets are
+    checked against the root relaxation only, so without them the search
+    only stops early if the incumbent meets it.
+
+    Args:
+        n: Number of activities
+        durations: List of durations
+        probabilities: List of KO probabilities
+        precedence: Acyclic PrecedenceRelation (or dict) of constraints (a, b)
+        time_limit: Time limit in seconds
+        incumbent: Optional (refined_precedence, expected_makespan) to beat
+        gap, absolute_gap: Gap targets as in solve()
+        symmetry_breaking: Order interchangeable activities by index only
+
+    Returns:
+        The same (precedence, cost, bound, is_optimal, is_timeout) tuple as solve()
+    """
+    start_time = time.perf_counter()
+    precedence = as_relation(precedence, n)
+    root_bound, best_precedence, best_cost, is_closed = start_search(
+        n, durations, probabilities, precedence, incumbent, gap, absolute_gap
+    )
+    best = [best_precedence, best_cost]
+    counts = {"nodes": 0, "pruned": 0}
+    # prune() turns down the root at once if the gap is already closed
+    stopped = ["gap"] if is_closed else []
+
+    def prune(evaluator):
+        counts["nodes"] += 1
+        if stopped:
+            return True
+        if (
+            time_limit is not None
+            and counts["nodes"] % TIME_CHECK_INTERVAL == 0
+            and time.perf_counter() - start_time > time_limit
+        ):
+            print(f"\nTimeout reached after {time.perf_counter() - start_time:.1f}s")
+            stopped.append("timeout")
+            return True
+        if best[1] <= lower_bound_from_starts(
+            evaluator.starts, durations, probabilities
+        ):
+            counts["pruned"] += 1
+            return True
+        return False
+
+    refinement_count = 0
+    for edges, evaluator in iter_refinements(
+        n, durations, probabilities, precedence, symmetry_breaking, prune, canonical_only=True
+    ):
+        refinement_count += 1
+        value = evaluator.expected_makespan
+        if value < best[1]:
+            relation = precedence.copy()
+            for a, b in edges:
+                relation.add(a, b)
+            best = [relation, value]
+            print(f"  *** New best: makespan = {value:.6f} ({len(edges)} added constraints) ***")
+            if gap_closed(value, root_bound, gap, absolute_gap):
+                print("  Gap target reached")
+                stopped.append("gap")
+                break
+
+    best_precedence, best_cost = best
+    print(f"\nVisited {refinement_count} refinements, {counts['nodes']} nodes, "
+          f"{counts['pruned']} pruned")
+
+    is_exhausted = not stopped
+    # An exhausted search has proved best_cost optimal over every refinement
+    bound = best_cost if is_exhausted else root_bound
+    return search_result(
+        best_precedence, best_cost, bound, "timeout" in stopped, start_time
+    )
+
+
+def iter_orientations(n, durations, probabilities, precedence, symmetry_breaking=True):
+    """
+    Yield the acyclic orientations of all unresolved pairs in Gray-code order.
+
+    With k unresolved pairs there are 2^k orientations; the acyclic ones are
+    the linear extensions of precedence, the pair model's search space. They
+    are walked in binary-reflected Gray-code order: a depth-first search over
+    the pairs that visits the children of a node in reverse whenever an odd
+    number of pairs above it were reversed. Over all 2^k orientations,
+    consecutive ones then differ in exactly one pair, and moving from one to
+    the next undoes and redoes only the pairs below the flipped one, O(1)
+    pairs on average. Closure, cycle status and expected makespan are all
+    updated by the IncrementalEvaluator. An orientation that closes a cycle
+    rules out the whole subtree below it, which is skipped, so two
+    consecutive yielded orientations can differ in several pairs.
+
+    With symmetry_breaking, interchangeable activities are ordered by index
+    up front, as the pair model does.
+
+    The yielded values are live views of the search state and are only valid
+    until the next orientation is requested.
+
+    Args:
+        n: Number of activities
+        durations: List of durations
+        probabilities: List of KO probabilities
+        precedence: Acyclic PrecedenceRelation (or dict) of constraints (a, b)
+        symmetry_breaking: Order interchangeable activities by index
+
+    Yields:
+        orientation: List of the chosen (a, b) constraint per unresolved pair
+        evaluator: IncrementalEvaluator of the oriented relation
+    """
+    relation = as_relation(precedence, n).copy()
+    if symmetry_breaking:
+        for members in interchangeable_classes(n, durations, probabilities, relation):
+            for a, b in zip(members, members[1:]):
+                relation.add(a, b)
+    evaluator = IncrementalEvaluator(n, durations, probabilities, relation)
+    closure = evaluator.closure
+
+    pairs = [
+        (a, b)
+        for a in range(n)
+        for b in range(a + 1, n)
+        if not closure.reaches(a, b) and not closure.reaches(b, a)
+    ]
+    orientation = []
+    if not pairs:
+        yield orientation, evaluator
+        return
+
+    # Each frame holds the bits still to try at its level, popped from the
+    # end (0: a < b, 1: b < a), and the parity of the bits above it
+    stack = [([1, 0], 0)]
+    while stack:
+        options, parity = stack[-1]
+        if not options:
+            stack.pop()
+            if orientation:
+                orientation.pop()
+                evaluator.undo()
+            continue
+
+        bit = options.pop()
+        a, b = pairs[len(stack) - 1]
+        edge = (b, a) if bit else (a, b)
+        if not evaluator.add_edge(*edge):
+            continue
+        orientation.append(edge)
+
+        if len(stack) == len(pairs):
+            yield orientation, evaluator
+            orientation.pop()
+            evaluator.undo()
+            continue
+        parity ^= bit
+        stack.append(([0, 1] if parity else [1, 0], parity))
+
+
+def solve_gray(
+    n,
+    durations,
+    probabilities,
+    precedence,
+    model_precedence=None,
+    time_limit=None,
+    incumbent=None,
+    gap=None,
+    absolute_gap=None,
+    symmetry_breaking=True,
+):
+    """
+    Exact oracle over the pair model's refinements by Gray-code enumeration.
+
+    Every acyclic orientation of the unresolved pairs of model_precedence is
+    evaluated (iter_orientations), without bound pruning, at close to
+    constant cost per orientation. Meant for instances with a modest number
+    of unresolved pairs. Nothing is pruned, so the bound stays the root
+    relaxation and only a gap target against it stops the search early.
+
+    A complete run gives the best linear extension, which a partial order can
+    still beat, so is_optimal is only set when the root bound is met.
+
+    Args:
+        n: Number of activities
+        durations: List of durations
+        probabilities: List of KO probabilities
+        precedence: Input PrecedenceRelation (baseline and lower bound)
+        model_precedence: Relation whose pairs are oriented (e.g. after
+            koref_preprocess.preprocess); defaults to precedence
+        time_limit: Time limit in seconds
+        incumbent: Optional (refined_precedence, expected_makespan) to beat
+        gap, absolute_gap: Gap targets as in solve()
+        symmetry_breaking: Order interchangeable activities by index
+
+    Returns:
+        The same (precedence, cost, bound, is_optimal, is_timeout) tuple as solve()
+    """
+    start_time = time.perf_counter()
+    precedence = as_relation(precedence, n)
+    if model_precedence is None:
+        model_precedence = precedence
+    model_precedence = as_relation(model_precedence, n)
+    root_bound, best_precedence, best_cost, is_closed = start_search(
+        n, durations, probabilities, precedence, incumbent, gap, absolute_gap
+    )
+
+    is_timeout = False
+    orientation_count = 0
+    if not is_closed:
+        for orientation, evaluator in iter_orientations(
+            n, durations, probabilities, model_precedence, symmetry_breaking
+        ):
+            orientation_count += 1
+            value = evaluator.expected_makespan
+            if value < best_cost:
+                best_cost = value
+                # The chain itself: symmetry breaking fixed pairs that are not in orientation
+                best_precedence = as_relation(
+                    evaluator.closure.snapshot().to_precedence(), n
+                ).transitive_reduction()
+                print(f"  *** New best: makespan = {best_cost:.6f} ***")
+                is_closed = gap_closed(best_cost, root_bound, gap, absolute_gap)
+                if is_closed:
+                    print("  Gap target reached")
+                    break
+            if (
+                time_limit is not None
+                and orientation_count % TIME_CHECK_INTERVAL == 0
+                and time.perf_counter() - start_time > time_limit
+            ):
+                print(f"\nTimeout reached after {time.perf_counter() - start_time:.1f}s")
+                is_timeout = True
+                break
+
+    print(f"\nEvaluated {orientation_count} acyclic orientations")
+    if not is_timeout and not is_closed:
+        print("All orientations evaluated: no linear extension beats the result")
+
+    # Exhausting the linear extensions proves nothing about the other refinements
+    return search_result(best_precedence, best_cost, root_bound, is_timeout, start_time)
@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+"""
+Incremental expected-makespan evaluation for KORef search.
+
+Adding a precedence a < b can only delay b and its descendants in the
+earliest-start schedule. IncrementalEvaluator keeps the schedule, abort times
+and bucket products of the current refinement and, for each inserted edge,
+only touches the activities whose start or abort time can change and the
+buckets from the earliest changed abort time onward. Every insertion can be
+undone in time proportional to what it changed.
+
+Adding a < b when b already starts at or after a's finish changes neither
+the schedule nor the expected makespan (is_noop), so many refinements share
+one schedule. is_schedule_canonical picks one of them per schedule, which
+lets exhaustive searches enumerate schedules instead of pair assignments.
+"""
+
+import bisect
+from collections import OrderedDict
+
+import numpy as np
+
+from koref_closure import IncrementalClosure
+from koref_utils import compute_earliest_start_schedule
+
+
+class IncrementalEvaluator:
+    """
+    Earliest-start schedule and expected makespan maintained under edge insertion.
+
+    The expected makespan is bit-for-bit the value compute_expected_makespan
+    returns for the current schedule: buckets are kept in the same order and
+    the bucket sum is kept as a sequential prefix sum, so only the suffix
+    after the first changed bucket is recomputed.
+    """
+
+    def __init__(self, n, durations, probabilities, precedence):
+        """
+        Args:
+            n: Number of activities
+            durations: List of durations
+            probabilities: List of KO probabilities
+            precedence: Acyclic dict mapping (a, b) -> True (initial relation)
+        """
+        self.n = n
+        self.durations = np.asarray(durations, dtype=float)
+        self.probabilities = list(probabilities)
+        self.closure = IncrementalClosure.from_precedence(precedence, n)
+
+        self.successors = [[] for _ in range(n)]
+        for (a, b), present in precedence.items():
+            if present:
+                self.successors[a].append(b)
+
+        activities = list(range(n))
+        schedule = compute_earliest_start_schedule(activities, precedence, durations)
+        self.starts = np.array([schedule.get(a, 0.0) for a in activities], dtype=float)
+        self.finishes = self.starts + self.durations
+
+        self.aborts = np.empty(n, dtype=float)
+        for a in range(n):
+            self.aborts[a] = self._abort_time(a)
+        self.events = sorted((float(self.aborts[a]), a) for a in range(n))
+
+        # Bucket state: times, survival products Q, cumulative P (len k+1),
+        # and prefix[j] = sequential sum of the first j makespan terms.
+        self.bucket_times = []
+        self.bucket_q = []
+        self.P = [1.0]
+        self.prefix = [0.0]
+        self._rebuild_buckets(0, 0)
+
+        self._undo = []
+
+    @property
+    def expected_makespan(self):
+        """Expected makespan of the current refinement."""
+        if not self.bucket_times:
+            return 0.0
+        return self.prefix[-1] + self.bucket_times[-1] * self.P[-1]
+
+    def schedule(self):
+        """Return the current schedule as a dict activity -> start_time."""
+        return {a: float(s) for a, s in enumerate(self.starts)}
+
+    def creates_cycle(self, a, b):
+        """Return True if adding a < b would create a cycle (O(1))."""
+        return self.closure.creates_cycle(a, b)
+
+    def add_edge(self, a, b):
+        """
+        Add a < b, propagating start-time changes to affected descendants only.
+
+        Returns:
+            False if the edge would create a cycle (nothing is changed),
+            True otherwise. Every accepted call can be reverted by undo().
+        """
+        if not self.closure.add_edge(a, b):
+            return False
+
+        self.successors[a].append(b)
+
+        # Step 1: Propagate start-time increases through direct successors
+        old_starts = {}
+        worklist = [b]
+        if self.finishes[a] > self.starts[b]:
+            old_starts[b] = float(self.starts[b])
+            self.starts[b] = self.finishes[a]
+            self.finishes[b] = self.starts[b] + self.durations[b]
+        else:
+            worklist = []
+
+        while worklist:
+            v = worklist.pop()
+            finish_v = self.finishes[v]
+            for w in self.successors[v]:
+                if finish_v > self.starts[w]:
+                    if w not in old_starts:
+                        old_starts[w] = float(self.starts[w])
+                    self.starts[w] = finish_v
+                    self.finishes[w] = finish_v + self.durations[w]
+                    worklist.append(w)
+
+        if not old_starts:
+            self._undo.append((a, b, None))
+            return True
+
+        # Step 2: Recompute abort times of activities overlapping old or new intervals
+        old_aborts = self._update_aborts(old_starts)
+
+        # Step 3: Recompute buckets from the earliest changed abort time onward
+        saved_buckets = None
+        if old_aborts:
+            threshold = min(
+                min(old for old in old_aborts.values()),
+                min(float(self.aborts[y]) for y in old_aborts),
+            )
+            saved_buckets = self._update_events(old_aborts, threshold)
+
+        self._undo.append((a, b, (old_starts, old_aborts, saved_buckets)))
+        return True
+
+    def undo(self):
+        """Revert the most recent accepted add_edge."""
+        a, b, record = self._undo.pop()
+        self.closure.undo()
+        self.successors[a].pop()
+
+        if record is None:
+            return
+
+        old_starts, old_aborts, saved_buckets = record
+        for v, start in old_starts.items():
+            self.starts[v] = start
+            self.finishes[v] = start + self.durations[v]
+
+        for y, old in old_aborts.items():
+            current = float(self.aborts[y])
+            del self.events[bisect.bisect_left(self.events, (current, y))]
+            bisect.insort(self.events, (old, y))
+            self.aborts[y] = old
+
+        if saved_buckets is not None:
+            j0, times, qs, P, prefix = saved_buckets
+            del self.bucket_times[j0:]
+            del self.bucket_q[j0:]
+            del self.P[j0 + 1:]
+            del self.prefix[j0 + 1:]
+            self.bucket_times.extend(times)
+            self.bucket_q.extend(qs)
+            self.P.extend(P)
+            self.prefix.extend(prefix)
+
+    def depth(self):
+        """Number of insertions that can be undone."""
+        return len(self._undo)
+
+    def undo_to(self, depth):
+        """Undo insertions until only depth of them remain."""
+        while len(self._undo) > depth:
+            self.undo()
+
+    def is_noop(self, a, b):
+        """Return True if adding a < b would leave the schedule unchanged."""
+        return self.finishes[a] <= self.starts[b]
+
+    def is_canonical(self):
+        """Return True if the current refinement is the canonical one of its schedule."""
+        return is_schedule_canonical(self.starts, self.durations, self.closure)
+
+    def evaluate_edge(self, a, b):
+        """
+        Expected makespan after adding a < b, leaving the state unchanged.
+
+        Returns:
+            Expected makespan, or None if the edge would create a cycle
+        """
+        if not self.add_edge(a, b):
+            return None
+        value = self.expected_makespan
+        self.undo()
+        return value
+
+    def _abort_time(self, a):
+        """Latest finish among activities whose interval overlaps a's."""
+        start_a = self.starts[a]
+        finish_a = self.finishes[a]
+        overlap = (self.starts < finish_a) & (self.finishes > start_a)
+        abort = finish_a
+        if overlap.any():
+            abort = max(abort, self.finishes[overlap].max())
+        return abort
+
+    def _update_aborts(self, old_starts):
+        """Recompute abort times touched by the moved activities."""
+        moved = np.fromiter(old_starts.keys(), dtype=int, count=len(old_starts))
+        old_s = np.fromiter(old_starts.values(), dtype=float, count=len(old_starts))
+        old_f = old_s + self.durations[moved]
+        new_s = self.starts[moved]
+        new_f = self.finishes[moved]
+
+        starts = self.starts[None, :]
+        finishes = self.finishes[None, :]
+        touched = (
+            ((starts < old_f[:, None]) & (finishes > old_s[:, None]))
+            | ((starts < new_f[:, None]) & (finishes > new_s[:, None]))
+        ).any(axis=0)
+        touched[moved] = True
+
+        old_aborts = {}
+        for y in np.flatnonzero(touched).tolist():
+            new_abort = float(self._abort_time(y))
+            old_abort = float(self.aborts[y])
+            if new_abort != old_abort:
+                old_aborts[y] = old_abort
+                self.aborts[y] = new_abort
+        return old_aborts
+
+    def _update_events(self, old_aborts, threshold):
+        """Move changed abort times in the sorted event list and rebuild buckets."""
+        for y, old in old_aborts.items():
+            del self.events[bisect.bisect_left(self.events, (old, y))]
+            bisect.insort(self.events, (float(self.aborts[y]), y))
+
+        j0 = bisect.bisect_left(self.bucket_times, threshold)
+        saved = (
+            j0,
+            self.bucket_times[j0:],
+            self.bucket_q[j0:],
+            self.P[j0 + 1:],
+            self.prefix[j0 + 1:],
+        )
+        del self.bucket_times[j0:]
+        del self.bucket_q[j0:]
+        del self.P[j0 + 1:]
+        del self.prefix[j0 + 1:]
+
+        self._rebuild_buckets(j0, bisect.bisect_left(self.events, (threshold, -1)))
+        return saved
+
+    def _rebuild_buckets(self, j, position):
+        """Append buckets for events[position:], continuing from bucket j."""
+        events = self.events
+        probabilities = self.probabilities
+        P = self.P
+        prefix = self.prefix
+        i = position
+        while i < len(events):
+            t_j = events[i][0]
+            q_j = 1.0
+            while i < len(events) and events[i][0] == t_j:
+                q_j *= (1.0 - probabilities[events[i][1]])
+                i += 1
+            self.bucket_times.append(t_j)
+            self.bucket_q.append(q_j)
+            prefix.append(prefix[j] + t_j * P[j] * (1.0 - q_j))
+            P.append(P[j] * q_j)
+            j += 1
+
+
+def is_schedule_canonical(starts, durations, closure):
+    """
+    Return True if a refinement orders every pair its schedule already orders.
+
+    With S the earliest-start schedule of a refinement R, every pair with
+    finish_a <= start_b could be ordered a < b without changing S. The
+    canonical refinement of S orders all of them, so any two activities it
+    leaves incomparable overlap in time. Two zero-duration activities at the
+    same instant are exempt: either order is a no-op there, and the input may
+    force one of them.
+
+    Every schedule of a refinement has a canonical refinement: the closure of
+    the input and all the pairs above is acyclic and has the same schedule.
+    Relabelling interchangeable activities maps canonical refinements to
+    canonical ones, so symmetry breaking keeps one per orbit.
+
+    Args:
+        starts: Sequence of earliest start times of the refinement
+        durations: Sequence of durations, aligned with starts
+        closure: BitsetClosure or IncrementalClosure of the refinement
+
+    Returns:
+        True if no pair with finish_a <= start_b is left unordered
+    """
+    starts = np.asarray(starts, dtype=float)
+    durations = np.asarray(durations, dtype=float)
+    finishes = starts + durations
+
+    ordered = finishes[:, None] <= starts[None, :]
+    zero = durations == 0
+    ordered &= ~(zero[:, None] & zero[None, :] & (starts[:, None] == starts[None, :]))
+    np.fill_diagonal(ordered, False)
+
+    rows = closure.rows
+    for a in np.flatnonzero(ordered.any(axis=1)).tolist():
+        required = 0
+        for b in np.flatnonzero(ordered[a]).tolist():
+            required |= 1 << b
+        if required & ~rows[a]:
+            return False
+    return True
+
+
+def schedule_signature(schedule, n):
+    """Canonical hashable key of a schedule: the start-time vector."""
+    return tuple(schedule.get(a, 0.0) for a in range(n))
+
+
+class TerminalCostCache:
+    """
+    Bounded LRU cache of expected makespans keyed by schedule signature.
+
+    Many refinements share one earliest-start schedule (e.g. an added edge
+    between activities that are already serialized), and the expected makespan
+    only depends on the schedule, so they can share one evaluation.
+    """
+
+    def __init__(self, maxsize=100000):
+        """
+        Args:
+            maxsize: Maximum number of entries; least recently used ones are
+                evicted first. 0 disables caching.
+        """
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        """Return the cached value for key, or None on a miss."""
+        value = self._entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def __repr__(self):
+        return (
+            f"TerminalCostCache(size={len(self)}, maxsize={self.maxsize}, "
+            f"hits={self.hits}, misses={self.misses}, evictions={self.evictions})"
+        )
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Exact kernelization of KORef instances.
+
+Each rule removes activities whose place in some optimal refinement is known
+in advance. The remaining kernel is solved as an ordinary instance and its
+solution is lifted back; the expected makespans then satisfy
+
+    E_full(lift(R)) = factor * E_kernel(R)
+
+for every refinement R of the kernel, so an optimal kernel refinement lifts
+to an optimal refinement of the input.
+
+Rule "knockout tail" (p = 1): every transitive successor of an activity with
+p = 1 is removed. In a refinement of the kernel the project has surely failed
+by the time T_K the last kernel activity finishes, so the integrand of
+E = integral prod (1 - p) dt is 0 beyond T_K. The lift starts the removed
+activities after every kernel activity: they overlap nothing, the integrand
+up to T_K is unchanged, and E_full = E_kernel. Removing them can only make
+the remaining activities start earlier, so no refinement of the input does
+better than the kernel optimum.
+
+Rule "zero-duration source" (d = 0, no predecessors left): the activity
+starts and aborts at time 0 and never overlaps anything, so it multiplies
+the integrand by (1 - p) on (0, T] and the factor absorbs it. It is applied
+repeatedly, since its zero-duration successors become sources in turn.
+
+Rule "zero-duration, no risk" (d = 0, p = 0): the activity contributes nothing
+to the integrand and only passes its predecessors' finish time on to its
+successors. It is contracted: the kernel keeps the implied constraints
+between its predecessors and successors.
+
+There is no matching rule for p = 0 activities with positive duration:
+putting them last is not optimal in general, because running a safe
+activity in parallel with a risky one can be cheaper than delaying either.
+"""
+
+from koref_relation import PrecedenceRelation, as_relation
+
+
+class Kernel:
+    """
+    Reduced instance together with what is needed to lift its solutions.
+
+    Attributes:
+        n, durations, probabilities, precedence: The kernel instance
+        activities: Original activity of each kernel activity
+        factor: Survival factor of the removed zero-duration sources
+        removed: List of (activity, rule) for every removed original activity
+    """
+
+    def __init__(
+        self, n, durations, probabilities, precedence, activities, factor, removed, tail, original
+    ):
+        self.n = n
+        self.durations = durations
+        self.probabilities = probabilities
+        self.precedence = precedence
+        self.activities = activities
+        self.factor = factor
+        self.removed = removed
+        self._tail = tail
+        self._original = original
+
+    def is_trivial(self):
+        """Return True if no activity was removed."""
+        return not self.removed
+
+    def lift(self, refined_precedence):
+        """
+        Map a refinement of the kernel to a refinement of the original instance.
+
+        Args:
+            refined_precedence: Refinement (dict or PrecedenceRelation) of the kernel
+
+        Returns:
+            PrecedenceRelation over the original activities
+        """
+        original = self._original
+        lifted = original.copy()
+        for pair, present in refined_precedence.items():
+            if present:
+                a, b = pair
+                lifted.add(self.activities[a], self.activities[b])
+
+        # The knockout tail follows every kernel activity; its own entry
+        # activities suffice, the rest of it follows through the input
+        tail_mask = sum(1 << b for b in self._tail)
+        predecessor_rows = original.closure().predecessor_rows()
+        for b in self._tail:
+            if predecessor_rows[b] & tail_mask:
+                continue
+            for a in self.activities:
+                lifted.add(a, b)
+        return lifted
+
+    def lift_cost(self, cost):
+        """Expected makespan (or bound) on the original instance of a kernel value."""
+        if cost is None:
+            return None
+        return self.factor * cost
+
+
+def kernelize(n, durations, probabilities, precedence):
+    """
+    Apply the exact reduction rules of the module docstring.
+
+    Args:
+        n: Number of activities
+        durations: List of durations
+        probabilities: List of KO probabilities
+        precedence: Acyclic PrecedenceRelation (or dict) of constraints (a, b)
+
+    Returns:
+        Kernel
+    """
+    original = as_relation(precedence, n)
+    closure = original.closure()
+    rows = list(closure.rows)
+    cols = closure.predecessor_rows()
+    alive = (1 << n) - 1
+    removed = []
+    factor = 1.0
+
+    # Knockout tail: everything after an activity that surely fails
+    tail = 0
+    for a in range(n):
+        if probabilities[a] >= 1.0:
+            tail |= rows[a]
+    tail_activities = [b for b in range(n) if (tail >> b) & 1]
+    for b in tail_activities:
+        removed.append((b, "knockout tail (after a p=1 activity)"))
+    alive &= ~tail
+
+    # Zero-duration activities, until no rule applies. The closure restricted
+    # to the remaining activities already contains every implied constraint.
+    changed = True
+    while changed:
+        changed = False
+        for a in range(n):
+            if not (alive >> a) & 1 or durations[a] != 0:
+                continue
+            if not cols[a] & alive:
+                factor *= 1.0 - probabilities[a]
+                removed.append((a, f"zero-duration source (factor {1.0 - probabilities[a]:g})"))
+            elif probabilities[a] == 0:
+                removed.append((a, "zero-duration, zero-risk (contracted)"))
+            else:
+                continue
+            alive &= ~(1 << a)
+            changed = True
+
+    activities = [a for a in range(n) if (alive >> a) & 1]
+    index = {a: k for k, a in enumerate(activities)}
+    kernel_precedence = PrecedenceRelation(
+        len(activities),
+        [
+            (index[a], index[b])
+            for a in activities
+            for b in activities
+            if (rows[a] >> b) & 1
+        ],
+    ).transitive_reduction()
+
+    return Kernel(
+        len(activities),
+        [durations[a] for a in activities],
+        [probabilities[a] for a in activities],
+        kernel_precedence,
+        activities,
+        factor,
+        removed,
+        tail_activities,
+        original,
+    )
+
+
+def report_kernel(kernel, n):
+    """Print the removed activities and the size of the kernel."""
+    print(f"Kernelization removed {len(kernel.removed)} of {n} activities "
+          f"(kernel: {kernel.n} activities, factor {kernel.factor:g}):")
+    for a, rule in kernel.removed:
+        print(f"  {a}: {rule}")
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+Parallel exhaustive search for KORef.
+
+The refinement space of the pair model (create_model) is split on the
+orientations of the first few unresolved pairs. Each subproblem is the input
+precedence plus one acyclic combination of fixed decisions; together they
+partition the space. Subproblems are solved with an exhaustive BrFS in a
+process pool, each worker building its own model (DIDP models cannot be
+shared between processes).
+
+Workers share the best expected makespan found so far. A subproblem whose
+own lower bound (koref_bounds.lower_bound of its precedence) is not below it
+cannot improve the incumbent and is skipped or stopped early, so every
+improvement found by one worker tightens the pruning of all others.
+
+The smallest bound over the subproblems not completed yet bounds the rest of
+the pair-model search. The main process shares it with the workers as it
+rises, and the gap targets are checked against it. Refinements outside the
+pair model are not covered, so this live bound only decides when to stop:
+the returned bound is the root bound, and exhausting every subproblem does
+not make the result optimal.
+"""
+
+import multiprocessing
+import time
+
+import didppy as dp
+
+from koref_bounds import gap_closed, lower_bound, search_result, start_search
+from koref_closure import IncrementalClosure
+from koref_evaluator import TerminalCostCache
+from koref_preprocess import class_index, interchangeable_classes
+from koref_relation import PrecedenceRelation, as_relation
+
+# Aim for this many subproblems per worker, so the pool stays busy when
+# some subproblems are pruned early
+SUBPROBLEMS_PER_WORKER = 4
+
+_shared_best = None
+_shared_bound = None
+
+
+def _init_worker(shared_best, shared_bound):
+    global _shared_best, _shared_bound
+    _shared_best = shared_best
+    _shared_bound = shared_bound
+
+
+def _offer(cost):
+    """Lower the shared best cost to cost if it is better."""
+    with _shared_best.get_lock():
+        if cost < _shared_best.value:
+            _shared_best.value = cost
+
+
+def split_subproblems(n, durations, probabilities, precedence, count, symmetry_breaking=True):
+    """
+    Split the linear extensions of precedence into disjoint subproblems.
+
+    The first k unresolved pairs are oriented both ways, with k the smallest
+    number giving at least count combinations (or all pairs if there are
+    fewer). Combinations that close a cycle are dropped, and with
+    symmetry_breaking interchangeable activities are only fixed in index
+    order, as in create_model.
+
+    Returns:
+        List of edge lists, each the fixed decisions of one subproblem
+    """
+    precedence = as_relation(precedence, n)
+    closure = precedence.closure()
+    pairs = [
+        (a, b)
+        for a in range(n)
+        for b in range(a + 1, n)
+        if not closure.comparable(a, b)
+    ]
+    depth = 0
+    while (1 << depth) < count and depth < len(pairs):
+        depth += 1
+
+    symmetric_class = [None] * n
+    if symmetry_breaking:
+        symmetric_class = class_index(
+            interchangeable_classes(n, durations, probabilities, precedence), n
+        )
+
+    incremental = IncrementalClosure(closure)
+    subproblems = []
+
+    def extend(k, decisions):
+        if k == depth:
+            subproblems.append(list(decisions))
+            return
+        a, b = pairs[k]
+        options = [(a, b)]
+        if symmetric_class[a] is None or symmetric_class[a] != symmetric_class[b]:
+            options.append((b, a))
+        for u, v in options:
+            if not incremental.add_edge(u, v):
+                continue
+            decisions.append((u, v))
+            extend(k + 1, decisions)
+            decisions.pop()
+            incremental.undo()
+
+    extend(0, [])
+    return subproblems
+
+
+def _solve_subproblem(task):
+    """
+    Exhaustively search one subproblem (runs in a worker process).
+
+    Returns:
+        (index, edges of the best refinement or None, its cost, completed, evaluated)
+
+    completed is True if the subproblem was exhausted or its lower bound is
+    not below the shared best cost; a stop on the global gap target or the
+    deadline leaves it False.
+    """
+    # Imported here: koref_domain imports this module
+    from koref_domain import compute_terminal_cost, create_model, extract_precedence_from_solution
+
+    (
+        index, n, durations, probabilities, edges, decisions, bound,
+        deadline, gap, absolute_gap, symmetry_breaking, cache_size,
+    ) = task
+    cache = TerminalCostCache(maxsize=cache_size)
+    subproblem = PrecedenceRelation(n, edges + decisions)
+
+    def stop():
+        """None to go on, else whether the subproblem counts as completed."""
+        best = _shared_best.value
+        if best <= bound:
+            return True  # Nothing left to find here
+        if gap_closed(best, _shared_bound.value, gap, absolute_gap):
+            return False  # The global target is met, the rest is unsearched
+        return None
+
+    completed = stop()
+    if completed is not None:
+        return index, None, None, completed, 0
+
+    model, pair_to_info, initial_precedence, _, _, _ = create_model(
+        n, durations, probabilities, subproblem, symmetry_breaking=symmetry_breaking
+    )
+    remaining = None if deadline is None else max(deadline - time.time(), 0.0)
+    solver = dp.BreadthFirstSearch(
+        model, time_limit=remaining, get_all_solutions=True, quiet=True
+    )
+
+    best_edges, best_cost = None, None
+    evaluated = 0
+    is_terminated = False
+    solution = None
+    while not is_terminated:
+        completed = stop()
+        if completed is not None:
+            return index, best_edges, best_cost, completed, evaluated
+        if deadline is not None and time.time() > deadline:
+            break
+        solution, is_terminated = solver.search_next()
+        if solution.is_infeasible:
+            continue
+        refined_precedence = extract_precedence_from_solution(
+            solution.transitions, n, initial_precedence, pair_to_info
+        )
+        if refined_precedence is None:
+            continue
+        relation = as_relation(refined_precedence, n)
+        cost = compute_terminal_cost(relation, n, durations, probabilities, cache)
+        evaluated += 1
+        if best_cost is None or cost < best_cost:
+            best_edges, best_cost = list(relation), cost
+            _offer(cost)
+
+    completed = is_terminated and not (solution is not None and solution.time_out)
+    return index, best_edges, best_cost, completed, evaluated
+
+
+def solve_parallel(
+    n,
+    durations,
+    probabilities,
+    precedence,
+    model_precedence=None,
+    threads=2,
+    time_limit=None,
+    incumbent=None,
+    gap=None,
+    absolute_gap=None,
+    symmetry_breaking=True,
+    cache_size=100000,
+):
+    """
+    Exhaustive pair-model search split across a process pool.
+
+    Args:
+        n: Number of activities
+        durations: List of durations
+        probabilities: List of KO probabilities
+        precedence: Input PrecedenceRelation (baseline and lower bound)
+        model_precedence: Relation to split and search (e.g. after
+            koref_preprocess.preprocess); defaults to precedence
+        threads: Number of worker processes
+        time_limit: Wall-clock limit in seconds for the whole search
+        incumbent: Optional (refined_precedence, expected_makespan) to beat
+        gap, absolute_gap: Gap targets as in solve()
+        symmetry_breaking: Order interchangeable activities by index
+        cache_size: Terminal-cost cache entries per worker (0 disables it)
+
+    Returns:
+        The same (precedence, cost, bound, is_optimal, is_timeout) tuple as
+        solve(), with the root bound as bound
+    """
+    start_time = time.perf_counter()
+    precedence = as_relation(precedence, n)
+    if model_precedence is None:
+        model_precedence = precedence
+    model_precedence = as_relation(model_precedence, n)
+
+    root_bound, best_precedence, best_cost, is_closed = start_search(
+        n, durations, probabilities, precedence, incumbent, gap, absolute_gap
+    )
+    if is_closed:
+        return search_result(best_precedence, best_cost, root_bound, False, start_time)
+
+    subproblems = split_subproblems(
+        n,
+        durations,
+        probabilities,
+        model_precedence,
+        threads * SUBPROBLEMS_PER_WORKER,
+        symmetry_breaking,
+    )
+    print(f"Parallel search: {len(subproblems)} subproblems on {threads} processes")
+
+    deadline = None if time_limit is None else time.time() + time_limit
+    edges = list(model_precedence)
+    bounds = [
+        lower_bound(n, durations, probabilities, PrecedenceRelation(n, edges + decisions))
+        for decisions in subproblems
+    ]
+    tasks = [
+        (
+            index, n, list(durations), list(probabilities), edges, decisions, bounds[index],
+            deadline, gap, absolute_gap, symmetry_breaking, cache_size,
+        )
+        for index, decisions in enumerate(subproblems)
+    ]
+    unfinished = set(range(len(subproblems)))
+
+    def live_bound():
+        """Lower bound on every pair-model refinement not ruled out yet (best_cost if none)."""
+        return min([best_cost] + [bounds[index] for index in unfinished])
+
+    shared_best = multiprocessing.Value("d", best_cost)
+    shared_bound = multiprocessing.Value("d", live_bound())
+    evaluated_count = 0
+    with multiprocessing.Pool(
+        threads, initializer=_init_worker, initargs=(shared_best, shared_bound)
+    ) as pool:
+        for index, result_edges, cost, completed, evaluated in pool.imap_unordered(
+            _solve_subproblem, tasks
+        ):
+            evaluated_count += evaluated
+            if cost is not None and cost < best_cost:
+                best_precedence, best_cost = PrecedenceRelation(n, result_edges), cost
+                print(f"  *** New best: makespan = {best_cost:.6f} ***")
+            if completed:
+                unfinished.discard(index)
+            shared_bound.value = live_bound()
+
+    print(f"Completed {len(subproblems) - len(unfinished)}/{len(subproblems)} subproblems, "
+          f"evaluated {evaluated_count} complete refinements")
+    is_closed = gap_closed(best_cost, live_bound(), gap, absolute_gap)
+    # Every subproblem was exhausted or cannot beat best_cost
+    is_exhausted = not unfinished
+    if is_exhausted:
+        print("  Search exhausted: no linear extension beats the result")
+    return search_result(
+        best_precedence, best_cost, root_bound, not is_exhausted and not is_closed, start_time
+    )
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Preprocessing that fixes precedence constraints before the DIDP model is built.
+
+Fixed constraints are added to the precedence relation, so create_model
+closes them transitively and never puts the resolved pairs into `unresolved`.
+Every fixed constraint is recorded as (a, b, reason).
+
+Safe rule (dominance between twins): activities i and j are twins if they
+have the same transitive predecessors and successors. If i dominates j
+(d_i <= d_j and p_i >= p_j, one of them strict), then in any linear extension
+with j before i, exchanging the two gives a linear extension that is never
+worse. With W the survival before j, M the weighted length and Q_M the
+survival of the activities in between, the exchange changes E by
+
+    -W * [(1 - Q_M)(d_j - d_i) + Q_M (p_i d_j - p_j d_i) + (p_i - p_j) M] <= 0
+
+Exchanging out-of-order twins reduces the number of inversions, so some
+optimal linear extension satisfies every such i < j at once. This holds for
+searches over linear extensions (create_model). Partial orders that keep i
+and j in parallel can be strictly better, so these constraints must not be
+added for the stage or transitive models.
+
+Symmetry: twins with identical duration and probability are
+interchangeable. Relabelling them maps refinements of the input to
+refinements with the same expected makespan, so each model only needs the
+refinements in which they are ordered by index (or left unordered). See
+interchangeable_classes.
+
+Unsafe rule (risk-ratio heuristic): order i before j when p_i / d_i exceeds
+p_j / d_j by more than a threshold factor. This is not proven and is only
+applied on request.
+"""
+
+import math
+
+from detect_forced_constraints import (
+    compute_dominance_constraints,
+    compute_risk_ratio_heuristic,
+)
+from koref_closure import IncrementalClosure
+from koref_relation import as_relation
+
+
+def twin_classes(n, precedence):
+    """
+    Group activities with identical transitive predecessors and successors.
+
+    Args:
+        n: Number of activities
+        precedence: PrecedenceRelation (or dict) of constraints (a, b)
+
+    Returns:
+        List of classes (lists of activities), in order of their smallest member
+    """
+    closure = as_relation(precedence, n).closure()
+    predecessor_rows = closure.predecessor_rows()
+    classes = {}
+    for a in range(n):
+        classes.setdefault((closure.rows[a], predecessor_rows[a]), []).append(a)
+    return list(classes.values())
+
+
+def interchangeable_classes(n, durations, probabilities, precedence):
+    """
+    Classes of twins that also share duration and KO probability.
+
+    Permuting the members of a class maps every refinement to one with the
+    same expected makespan. Each class is sorted, and only classes with at
+    least two members are returned.
+
+    Args:
+        n: Number of activities
+        durations: List of durations
+        probabilities: List of KO probabilities
+        precedence: PrecedenceRelation (or dict) of constraints (a, b)
+
+    Returns:
+        List of classes (sorted lists of activities)
+    """
+    classes = []
+    for members in twin_classes(n, precedence):
+        groups = {}
+        for a in members:
+            groups.setdefault((durations[a], probabilities[a]), []).append(a)
+        classes.extend(group for group in groups.values() if len(group) > 1)
+    return classes
+
+
+def class_index(classes, n):
+    """Map each activity to the index of its class, or None if it has none."""
+    index = [None] * n
+    for k, members in enumerate(classes):
+        for a in members:
+            index[a] = k
+    return index
+
+
+def symmetry_factor(classes):
+    """
+    Size of the largest orbit of refinements under permuting the classes.
+
+    With symmetry breaking, one refinement per orbit is explored, so up to
+    this many symmetric refinements are pruned per explored one.
+    """
+    return math.prod(math.factorial(len(members)) for members in classes)
+
+
+def safe_dominance_constraints(n, durations, probabilities, precedence):
+    """
+    Dominance constraints i < j that are safe for linear-extension search.
+
+    Only pairs of twins in precedence qualify (see the module docstring).
+
+    Returns:
+        Sorted list of (i, j) pairs
+    """
+    twin_of = [0] * n
+    for k, members in enumerate(twin_classes(n, precedence)):
+        for a in members:
+            twin_of[a] = k
+    return sorted(
+        (i, j)
+        for i, j in compute_dominance_constraints(n, durations, probabilities)
+        if twin_of[i] == twin_of[j]
+    )
+
+
+def preprocess(n, durations, probabilities, precedence, unsafe=False, threshold=2.0):
+    """
+    Fix safe dominance constraints (and, if unsafe, risk-ratio suggestions).
+
+    Args:
+        n: Number of activities
+        durations: List of durations
+        probabilities: List of KO probabilities
+        precedence: PrecedenceRelation (or dict) of original constraints (a, b)
+        unsafe: Also apply the risk-ratio heuristic, which may cut off the optimum
+        threshold: Ratio factor of the risk-ratio heuristic
+
+    Returns:
+        refined_precedence: New PrecedenceRelation with the fixed constraints added
+        fixed: List of (a, b, reason) for every constraint that resolved a pair
+    """
+    refined_precedence = as_relation(precedence, n).copy()
+    closure = IncrementalClosure(refined_precedence.closure())
+    fixed = []
+
+    def fix(a, b, reason):
+        if closure.reaches(a, b) or closure.creates_cycle(a, b):
+            return
+        closure.add_edge(a, b)
+        refined_precedence.add(a, b)
+        fixed.append((a, b, reason))
+
+    for i, j in safe_dominance_constraints(n, durations, probabilities, precedence):
+        fix(
+            i,
+            j,
+            f"dominance (twins): d={durations[i]:g} <= {durations[j]:g}, "
+            f"p={probabilities[i]:g} >= {probabilities[j]:g}",
+        )
+
+    if unsafe:
+        suggestions = compute_risk_ratio_heuristic(n, durations, probabilities, threshold)
+
+        def ratio(a):
+            return probabilities[a] / durations[a]
+
+        # Strongest suggestions first, so they win when two would close a cycle
+        for i, j in sorted(suggestions, key=lambda pair: (-ratio(pair[0]) / ratio(pair[1]), pair)):
+            fix(
+                i,
+                j,
+                f"risk-ratio heuristic (unsafe): p/d={ratio(i):g} vs {ratio(j):g}",
+            )
+
+    return refined_precedence, fixed
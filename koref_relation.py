@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+Compact precedence relation shared by the KORef modules.
+
+PrecedenceRelation stores the direct edges as one successor bitset per
+activity and caches derived structures (closure, topological order,
+transitive reduction) until the next mutation. It also behaves like the old
+{(a, b): True} dict, so code written against that format keeps working.
+"""
+
+from collections import deque
+
+import numpy as np
+
+from koref_closure import BitsetClosure, close_rows, iter_bits
+
+
+class PrecedenceRelation:
+    """
+    Direct precedence edges a < b over activities 0..n-1.
+
+    Supports the dict operations used throughout the code base:
+    (a, b) in rel, rel[(a, b)] = True, rel.get((a, b), False), rel.items(),
+    rel.keys(), len(rel), rel.copy(). Iteration yields (a, b) edges in
+    row-major order.
+    """
+
+    __slots__ = ("n", "succ", "_size", "_closure", "_topo", "_reduction")
+
+    def __init__(self, n, edges=()):
+        """
+        Args:
+            n: Number of activities
+            edges: Iterable of (a, b) pairs meaning a precedes b
+        """
+        self.n = n
+        self.succ = [0] * n
+        self._size = 0
+        self._invalidate()
+        for a, b in edges:
+            self.add(a, b)
+
+    @classmethod
+    def from_dict(cls, precedence, n):
+        """Build a relation from a dict mapping (a, b) -> True."""
+        return cls(n, [pair for pair, present in precedence.items() if present])
+
+    def to_dict(self):
+        """Return the direct edges as the old {(a, b): True} dict."""
+        return {pair: True for pair in self}
+
+    def copy(self):
+        rel = PrecedenceRelation.__new__(PrecedenceRelation)
+        rel.n = self.n
+        rel.succ = list(self.succ)
+        rel._size = self._size
+        rel._closure = self._closure
+        rel._topo = self._topo
+        rel._reduction = self._reduction
+        return rel
+
+    def _invalidate(self):
+        self._closure = None
+        self._topo = None
+        self._reduction = None
+
+    # Mutation
+
+    def add(self, a, b):
+        """Add the direct edge a < b."""
+        bit = 1 << b
+        if not self.succ[a] & bit:
+            self.succ[a] |= bit
+            self._size += 1
+            self._invalidate()
+
+    def discard(self, a, b):
+        """Remove the direct edge a < b if present."""
+        bit = 1 << b
+        if self.succ[a] & bit:
+            self.succ[a] &= ~bit
+            self._size -= 1
+            self._invalidate()
+
+    def __setitem__(self, pair, present):
+        if present:
+            self.add(*pair)
+        else:
+            self.discard(*pair)
+
+    def __delitem__(self, pair):
+        if pair not in self:
+            raise KeyError(pair)
+        self.discard(*pair)
+
+    # Dict-compatible queries
+
+    def __contains__(self, pair):
+        a, b = pair
+        return 0 <= a < self.n and (self.succ[a] >> b) & 1 == 1
+
+    def __getitem__(self, pair):
+        if pair not in self:
+            raise KeyError(pair)
+        return True
+
+    def get(self, pair, default=None):
+        return True if pair in self else default
+
+    def __iter__(self):
+        for a, row in enumerate(self.succ):
+            for b in iter_bits(row):
+                yield (a, b)
+
+    def keys(self):
+        return list(self)
+
+    def values(self):
+        return [True] * self._size
+
+    def items(self):
+        return [(pair, True) for pair in self]
+
+    def __len__(self):
+        return self._size
+
+    def __bool__(self):
+        return self._size > 0
+
+    def __eq__(self, other):
+        if isinstance(other, PrecedenceRelation):
+            return self.n == other.n and self.succ == other.succ
+        if isinstance(other, dict):
+            return set(self) == {pair for pair, present in other.items() if present}
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"PrecedenceRelation(n={self.n}, edges={sorted(self)})"
+
+    # Derived structures (cached until the next mutation)
+
+    def closure(self):
+        """Return the transitive closure as a BitsetClosure (cached)."""
+        if self._closure is None:
+            self._closure = BitsetClosure(self.n, close_rows(list(self.succ)))
+        return self._closure
+
+    def reaches(self, a, b):
+        """Return True if a precedes b transitively."""
+        return self.closure().reaches(a, b)
+
+    def is_acyclic(self):
+        return self.topological_order() is not None
+
+    def topological_order(self):
+        """
+        Return a topological order of the activities (cached), or None if cyclic.
+
+        Kahn's algorithm over the direct edges, O(n + m); ready activities are
+        processed first-in first-out, as in compute_earliest_start_schedule.
+        """
+        if self._topo is None:
+            in_degree = [0] * self.n
+            for row in self.succ:
+                for b in iter_bits(row):
+                    in_degree[b] += 1
+            queue = deque(a for a in range(self.n) if in_degree[a] == 0)
+            order = []
+            while queue:
+                a = queue.popleft()
+                order.append(a)
+                for b in iter_bits(self.succ[a]):
+                    in_degree[b] -= 1
+                    if in_degree[b] == 0:
+                        queue.append(b)
+            self._topo = order if len(order) == self.n else False
+        if self._topo is False:
+            return None
+        return list(self._topo)
+
+    def transitive_reduction(self):
+        """
+        Return the transitive reduction as a new PrecedenceRelation (cached).
+
+        Only defined for acyclic relations; raises ValueError otherwise.
+        """
+        if self._reduction is None:
+            if not self.is_acyclic():
+                raise ValueError("transitive reduction of a cyclic relation")
+            rows = self.closure().rows
+            reduced = PrecedenceRelation(self.n)
+            for a, row in enumerate(rows):
+                implied = 0
+                for c in iter_bits(row):
+                    implied |= rows[c]
+                reduced.succ[a] = row & ~implied
+                reduced._size += bin(reduced.succ[a]).count("1")
+            self._reduction = reduced
+        return self._reduction.copy()
+
+    def predecessors(self, b):
+        """Return the direct predecessors of b."""
+        bit = 1 << b
+        return [a for a, row in enumerate(self.succ) if row & bit]
+
+    def successors(self, a):
+        """Return the direct successors of a."""
+        return list(iter_bits(self.succ[a]))
+
+    def to_matrix(self):
+        """Return a NumPy bool adjacency matrix of shape (n, n)."""
+        matrix = np.zeros((self.n, self.n), dtype=bool)
+        for a, b in self:
+            matrix[a, b] = True
+        return matrix
+
+
+def as_relation(precedence, n):
+    """
+    Return precedence as a PrecedenceRelation, converting a dict if needed.
+
+    Relations are returned as-is so their cached closure is reused.
+    """
+    if isinstance(precedence, PrecedenceRelation):
+        return precedence
+    return PrecedenceRelation.from_dict(precedence, n)
@@ -3,17 +3,69 @@
 Utility functions for KORef: schedule computation and expected makespan calculation.
 """
 
+from collections import deque
+
+import numpy as np
+
+from koref_relation import as_relation
+
 
 def compute_earliest_start_schedule(activities, precedence, durations):
     """
     Compute the canonical earliest-start schedule for a given partial order.
     
-    Uses the transitive closure of the precedence relation to ensure all
-    transitive dependencies are respected.
+    Longest-path pass over the direct edges in topological order, O(n + m).
+    A longest path through direct edges reaches the same start time as the
+    maximum over all transitive predecessors, so no closure is needed.
+    Activities on or behind a cycle are left out of the schedule, as in the
+    reference implementation.
     
     Args:
         activities: List of activity indices [0, 1, ..., n-1]
-        precedence: Dict mapping (a, b) -> True if a must precede b
+        precedence: PrecedenceRelation or dict mapping (a, b) -> True if a must precede b
+        durations: List of durations for each activity
+    
+    Returns:
+        schedule: Dict mapping activity -> start_time
+    """
+    n = len(activities)
+    relation = as_relation(precedence, n)
+    successors = [relation.successors(a) for a in range(n)]
+    
+    in_degree = [0] * n
+    for succ in successors:
+        for b in succ:
+            in_degree[b] += 1
+    
+    start_times = [0.0] * n
+    queue = deque(a for a in range(n) if in_degree[a] == 0)
+    schedule = {}
+    
+    while queue:
+        a = queue.popleft()
+        schedule[a] = start_times[a]
+        finish = start_times[a] + durations[a]
+        
+        for b in successors[a]:
+            if finish > start_times[b]:
+                start_times[b] = finish
+            in_degree[b] -= 1
+            if in_degree[b] == 0:
+                queue.append(b)
+    
+    return schedule
+
+
+def compute_earliest_start_schedule_reference(activities, precedence, durations):
+    """
+    Compute the canonical earliest-start schedule for a given partial order.
+    
+    Reference version scanning the full transitive closure (O(n^2) per
+    activity). Kept to cross-check compute_earliest_start_schedule.
+    
+    Args:
+        activities: List of activity indices [0, 1, ..., n-1]
+        precedence: PrecedenceRelation or dict mapping (a, b) -> True if a must precede b
         durations: List of durations for each activity
     
     Returns:
@@ -63,6 +115,22 @@ def compute_transitive_closure(precedence, n):
     """
     Compute the transitive closure of a precedence relation.
     
+    Args:
+        precedence: PrecedenceRelation or dict mapping (a, b) -> True if a precedes b
+        n: Number of activities
+    
+    Returns:
+        closure: Dict mapping (a, b) -> True if a precedes b (transitively)
+    """
+    return as_relation(precedence, n).closure().to_dict()
+
+
+def compute_transitive_closure_reference(precedence, n):
+    """
+    Reference Floyd-Warshall closure over dicts (O(n^3) lookups).
+    
+    Kept to cross-check BitsetClosure; use compute_transitive_closure instead.
+    
     Args:
         precedence: Dict mapping (a, b) -> True if a precedes b
         n: Number of activities
@@ -95,20 +163,13 @@ def check_acyclic(precedence, n):
     Check if a precedence relation is acyclic.
     
     Args:
-        precedence: Dict mapping (a, b) -> True if a precedes b
+        precedence: PrecedenceRelation or dict mapping (a, b) -> True if a precedes b
         n: Number of activities
     
     Returns:
         True if acyclic, False otherwise
     """
-    closure = compute_transitive_closure(precedence, n)
-    
-    # Check for self-loops (cycles)
-    for a in range(n):
-        if closure.get((a, a), False):
-            return False
-    
-    return True
+    return as_relation(precedence, n).is_acyclic()
 
 
 def compute_expected_makespan(activities, schedule, durations, probabilities):
@@ -184,3 +245,230 @@ def compute_expected_makespan(activities, schedule, durations, probabilities):
     expected_makespan += T * P[k]
     
     return expected_makespan
+
+
+def compute_abort_times_array(starts, finishes):
+    """
+    Compute abort times for all activities with a sort-and-sweep.
+    
+    The abort time of activity a is the latest finish time among a and all
+    activities whose interval [start, finish) overlaps a's interval. Activity b
+    can only overlap a if start_b < finish_a, i.e. b lies in a prefix of the
+    activities sorted by start time. Taking the running maximum of finish times
+    over that prefix gives the abort time in O(n log n) instead of O(n^2).
+    
+    Args:
+        starts: NumPy array of start times
+        finishes: NumPy array of finish times
+    
+    Returns:
+        abort_times: NumPy array of abort times
+    """
+    if len(starts) == 0:
+        return np.zeros(0, dtype=float)
+    
+    order = np.argsort(starts, kind="stable")
+    sorted_starts = starts[order]
+    prefix_max_finish = np.maximum.accumulate(finishes[order])
+    
+    # Number of activities that start strictly before each finish time
+    counts = np.searchsorted(sorted_starts, finishes, side="left")
+    
+    abort_times = finishes.copy()
+    has_prefix = counts > 0
+    # If the prefix maximum does not exceed start_a, nothing overlaps a and the
+    # maximum with finish_a leaves the abort time unchanged.
+    abort_times[has_prefix] = np.maximum(
+        finishes[has_prefix], prefix_max_finish[counts[has_prefix] - 1]
+    )
+    
+    return abort_times
+
+
+def compute_expected_makespan_array(starts, durations, probabilities):
+    """
+    Compute the expected makespan from start-time arrays.
+    
+    Array-backed version of compute_expected_makespan: abort times come from
+    a sort-and-sweep, buckets from a stable sort by abort time, and bucket
+    survival products from multiply.reduceat followed by a cumulative product.
+    Produces the same floating-point result as the reference implementation.
+    
+    Args:
+        starts: Sequence of start times, indexed by position
+        durations: Sequence of durations, aligned with starts
+        probabilities: Sequence of KO probabilities, aligned with starts
+    
+    Returns:
+        Expected makespan (float)
+    """
+    starts = np.asarray(starts, dtype=float)
+    if starts.size == 0:
+        return 0.0
+    durations = np.asarray(durations, dtype=float)
+    probabilities = np.asarray(probabilities, dtype=float)
+    
+    # Step 1: Compute completion times
+    finishes = starts + durations
+    T = finishes.max()
+    
+    # Step 2: Compute abort times (sweep over start-sorted intervals)
+    abort_times = compute_abort_times_array(starts, finishes)
+    
+    # Step 3: Group by abort times into buckets (stable sort keeps activity order)
+    order = np.argsort(abort_times, kind="stable")
+    sorted_aborts = abort_times[order]
+    bucket_starts = np.flatnonzero(np.r_[True, sorted_aborts[1:] != sorted_aborts[:-1]])
+    t = sorted_aborts[bucket_starts]
+    
+    # Step 4: Compute bucket survival probabilities
+    Q = np.multiply.reduceat(1.0 - probabilities[order], bucket_starts)
+    
+    # Step 5: Compute cumulative probabilities P_j (P_0 = 1)
+    P = np.empty(len(Q) + 1)
+    P[0] = 1.0
+    np.cumprod(Q, out=P[1:])
+    
+    # Step 6: Compute expected makespan (summed in bucket order like the reference)
+    terms = t * P[:-1] * (1.0 - Q)
+    expected_makespan = 0.0
+    for term in terms.tolist():
+        expected_makespan += term
+    
+    expected_makespan += T * P[-1]
+    
+    return float(expected_makespan)
+
+
+def compute_expected_makespan_fast(activities, schedule, durations, probabilities):
+    """
+    Drop-in replacement for compute_expected_makespan backed by NumPy arrays.
+    
+    compute_expected_makespan remains the reference implementation this
+    kernel is checked against.
+    
+    Args:
+        activities: List of activity indices
+        schedule: Dict mapping activity -> start_time
+        durations: List of durations for each activity
+        probabilities: List of KO probabilities for each activity
+    
+    Returns:
+        Expected makespan (float)
+    """
+    starts = [schedule.get(a, 0.0) for a in activities]
+    return compute_expected_makespan_array(
+        starts,
+        [durations[a] for a in activities],
+        [probabilities[a] for a in activities],
+    )
+
+
+def precedence_to_matrix(precedence, n):
+    """
+    Convert a precedence dict to a dense boolean adjacency matrix.
+    
+    Args:
+        precedence: Dict or PrecedenceRelation mapping (a, b) -> True if a precedes b
+        n: Number of activities
+    
+    Returns:
+        NumPy bool array of shape (n, n) with [a, b] True iff a precedes b
+    """
+    if hasattr(precedence, "to_matrix"):
+        return precedence.to_matrix()
+    matrix = np.zeros((n, n), dtype=bool)
+    for (a, b), present in precedence.items():
+        if present:
+            matrix[a, b] = True
+    return matrix
+
+
+def compute_expected_makespan_batch(precedence_matrices, durations, probabilities):
+    """
+    Evaluate a batch of candidate refinements of one instance at once.
+    
+    Closure, earliest-start schedule, abort times and bucket products are all
+    computed with array operations across the batch, so the Python overhead is
+    paid once per batch instead of once per candidate. Feasible candidates get
+    exactly the value compute_expected_makespan returns for their schedule.
+    
+    Args:
+        precedence_matrices: Bool array of shape (B, n, n); [i, a, b] True iff
+            a precedes b in candidate i (direct edges are enough)
+        durations: List of durations for each activity
+        probabilities: List of KO probabilities for each activity
+    
+    Returns:
+        makespans: Float array of shape (B,), NaN for cyclic candidates
+        feasible: Bool array of shape (B,), False for cyclic candidates
+    """
+    closure = np.array(precedence_matrices, dtype=bool, copy=True)
+    if closure.ndim != 3 or closure.shape[1] != closure.shape[2]:
+        raise ValueError("precedence_matrices must have shape (B, n, n)")
+    B, n, _ = closure.shape
+    durations = np.asarray(durations, dtype=float)
+    probabilities = np.asarray(probabilities, dtype=float)
+    
+    makespans = np.full(B, np.nan)
+    if B == 0:
+        return makespans, np.zeros(0, dtype=bool)
+    if n == 0:
+        makespans[:] = 0.0
+        return makespans, np.ones(B, dtype=bool)
+    
+    # Step 1: Transitive closure (Warshall, vectorized over the batch)
+    for k in range(n):
+        closure |= closure[:, :, k, None] & closure[:, None, k, :]
+    
+    feasible = ~np.diagonal(closure, axis1=1, axis2=2).any(axis=1)
+    closure &= feasible[:, None, None]
+    
+    # Step 2: Earliest-start schedule as a fixpoint over transitive predecessors
+    starts = np.zeros((B, n))
+    for _ in range(n):
+        finishes = starts + durations
+        new_starts = np.where(closure, finishes[:, :, None], 0.0).max(axis=1)
+        if np.array_equal(new_starts, starts):
+            break
+        starts = new_starts
+    finishes = starts + durations
+    
+    # Step 3: Abort times from pairwise interval overlap
+    overlap = (starts[:, None, :] < finishes[:, :, None]) & (
+        finishes[:, None, :] > starts[:, :, None]
+    )
+    aborts = np.maximum(
+        finishes, np.where(overlap, finishes[:, None, :], 0.0).max(axis=2)
+    )
+    
+    # Step 4: Buckets per candidate (stable sort keeps activity order in a bucket)
+    order = np.argsort(aborts, axis=1, kind="stable")
+    sorted_aborts = np.take_along_axis(aborts, order, axis=1)
+    survival = 1.0 - probabilities[order]
+    new_bucket = np.ones((B, n), dtype=bool)
+    new_bucket[:, 1:] = sorted_aborts[:, 1:] != sorted_aborts[:, :-1]
+    bucket_ids = np.cumsum(new_bucket, axis=1) - 1
+    
+    flat_starts = np.flatnonzero(new_bucket.ravel())
+    flat_q = np.multiply.reduceat(survival.ravel(), flat_starts)
+    rows = flat_starts // n
+    cols = bucket_ids.ravel()[flat_starts]
+    
+    # Unused bucket slots are padded with Q = 1, t = 0 so they add nothing
+    Q = np.ones((B, n))
+    Q[rows, cols] = flat_q
+    t = np.zeros((B, n))
+    t[rows, cols] = sorted_aborts.ravel()[flat_starts]
+    
+    # Step 5: Cumulative probabilities P_j
+    P = np.ones((B, n + 1))
+    np.cumprod(Q, axis=1, out=P[:, 1:])
+    
+    # Step 6: Expected makespan (cumsum keeps the reference's summation order)
+    terms = t * P[:, :-1] * (1.0 - Q)
+    T = finishes.max(axis=1)
+    values = np.cumsum(terms, axis=1)[:, -1] + T * P[:, -1]
+    makespans[feasible] = values[feasible]
+    
+    return makespans, feasible
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Warm-start incumbents for KORef solvers.
+
+Three cheap constructions, each a refinement of the input precedence:
+
+- ratio chain: a linear extension that always runs the available activity
+  with the largest p / d next (risky, short activities first)
+- greedy insertion: starting from the input, repeatedly add the single
+  constraint that lowers the expected makespan most
+- random chains: the best of several random linear extensions
+
+warm_start returns the best of them. solve() and solve_staged() start from
+it instead of the input precedence, and models whose cost is the expected
+makespan (create_stage_model) also receive its cost as primal bound.
+"""
+
+import heapq
+import random
+import time
+
+from koref_evaluator import IncrementalEvaluator
+from koref_relation import as_relation
+from koref_utils import compute_earliest_start_schedule, compute_expected_makespan_fast
+
+# Default time budget of warm_start in seconds (greedy insertion stops there)
+WARM_START_TIME_LIMIT = 5.0
+
+# Random linear extensions sampled by warm_start
+WARM_START_SAMPLES = 16
+
+
+def expected_makespan(n, durations, probabilities, precedence):
+    """Expected makespan of the earliest-start schedule of precedence."""
+    activities = list(range(n))
+    schedule = compute_earliest_start_schedule(activities, precedence, durations)
+    return compute_expected_makespan_fast(activities, schedule, durations, probabilities)
+
+
+def chain_relation(order, n, precedence):
+    """Refinement of precedence that runs the activities one after another in order."""
+    relation = as_relation(precedence, n).copy()
+    for a, b in zip(order, order[1:]):
+        relation.add(a, b)
+    return relation
+
+
+def ratio_chain(n, durations, probabilities, precedence):
+    """
+    Linear extension of precedence that prefers activities with a large p / d.
+
+    Zero-duration activities come first among the available ones.
+
+    Returns:
+        List of activities in chain order
+    """
+    relation = as_relation(precedence, n)
+
+    def key(a):
+        if durations[a] == 0:
+            return (0, 0.0, a)
+        return (1, -probabilities[a] / durations[a], a)
+
+    in_degree = [0] * n
+    for a in range(n):
+        for b in relation.successors(a):
+            in_degree[b] += 1
+    ready = [key(a) for a in range(n) if in_degree[a] == 0]
+    heapq.heapify(ready)
+
+    order = []
+    while ready:
+        a = heapq.heappop(ready)[2]
+        order.append(a)
+        for b in relation.successors(a):
+            in_degree[b] -= 1
+            if in_degree[b] == 0:
+                heapq.heappush(ready, key(b))
+    return order
+
+
+def random_linear_extension(n, precedence, rng):
+    """Uniformly pick each next activity among the available ones."""
+    relation = as_relation(precedence, n)
+    in_degree = [0] * n
+    for a in range(n):
+        for b in relation.successors(a):
+            in_degree[b] += 1
+    ready = [a for a in range(n) if in_degree[a] == 0]
+
+    order = []
+    while ready:
+        a = ready.pop(rng.randrange(len(ready)))
+        order.append(a)
+        for b in relation.successors(a):
+            in_degree[b] -= 1
+            if in_degree[b] == 0:
+                ready.append(b)
+    return order
+
+
+def greedy_insertion(n, durations, probabilities, precedence, deadline=None):
+    """
+    Add the best single constraint while it lowers the expected makespan.
+
+    Each round evaluates every unordered pair in both directions with
+    IncrementalEvaluator.evaluate_edge; constraints that would not change
+    the schedule (is_noop) are skipped.
+
+    Args:
+        n: Number of activities
+        durations: List of durations
+        probabilities: List of KO probabilities
+        precedence: Acyclic PrecedenceRelation (or dict) of constraints (a, b)
+        deadline: time.perf_counter() value after which no new round starts
+            and the current one stops early
+
+    Returns:
+        refined_precedence: PrecedenceRelation with the added constraints
+        expected_makespan: Its expected makespan
+    """
+    relation = as_relation(precedence, n).copy()
+    evaluator = IncrementalEvaluator(n, durations, probabilities, relation)
+    current = evaluator.expected_makespan
+
+    while deadline is None or time.perf_counter() < deadline:
+        best = None
+        for a in range(n):
+            for b in range(n):
+                if a == b or evaluator.closure.reaches(a, b) or evaluator.closure.reaches(b, a):
+                    continue
+                if evaluator.is_noop(a, b):
+                    continue
+                value = evaluator.evaluate_edge(a, b)
+                if value < current and (best is None or value < best[0]):
+                    best = (value, a, b)
+            if deadline is not None and time.perf_counter() >= deadline:
+                break
+        if best is None:
+            break
+        current, a, b = best
+        evaluator.add_edge(a, b)
+        relation.add(a, b)
+
+    return relation, current
+
+
+def warm_start(
+    n,
+    durations,
+    probabilities,
+    precedence,
+    time_limit=WARM_START_TIME_LIMIT,
+    samples=WARM_START_SAMPLES,
+    seed=2023,
+):
+    """
+    Best of the ratio chain, random chains and greedy insertion.
+
+    The input precedence itself is a candidate too, so the result is never
+    worse than it.
+
+    Args:
+        n: Number of activities
+        durations: List of durations
+        probabilities: List of KO probabilities
+        precedence: Acyclic PrecedenceRelation (or dict) of constraints (a, b)
+        time_limit: Time budget in seconds (None: run greedy insertion to the end)
+        samples: Number of random linear extensions
+        seed: Seed of the random linear extensions
+
+    Returns:
+        refined_precedence: Best refinement found
+        expected_makespan: Its expected makespan
+        source: Name of the construction that found it
+        elapsed: Seconds from the start until it was found
+    """
+    start_time = time.perf_counter()
+    deadline = None if time_limit is None else start_time + time_limit
+    precedence = as_relation(precedence, n)
+
+    best = [
+        precedence.copy(),
+        expected_makespan(n, durations, probabilities, precedence),
+        "input",
+        time.perf_counter() - start_time,
+    ]
+
+    def offer(relation, cost, source):
+        if cost < best[1]:
+            best[:] = [relation, cost, source, time.perf_counter() - start_time]
+
+    chain = chain_relation(ratio_chain(n, durations, probabilities, precedence), n, precedence)
+    offer(chain, expected_makespan(n, durations, probabilities, chain), "ratio chain")
+
+    rng = random.Random(seed)
+    for _ in range(samples):
+        if deadline is not None and time.perf_counter() >= deadline:
+            break
+        chain = chain_relation(random_linear_extension(n, precedence, rng), n, precedence)
+        offer(chain, expected_makespan(n, durations, probabilities, chain), "random chain")
+
+    relation, _ = greedy_insertion(n, durations, probabilities, precedence, deadline)
+    offer(relation, expected_makespan(n, durations, probabilities, relation), "greedy insertion")
+
+    return tuple(best)
@@ -7,6 +7,8 @@ Supports both YAML format (preferred) and legacy text format.
 import os
 import yaml
 
+from koref_relation import PrecedenceRelation, as_relation
+
 
 def read(filename):
     """
@@ -21,7 +23,7 @@ def read(filename):
         n: Number of activities
         durations: List of durations
         probabilities: List of KO probabilities
-        precedence: Dict mapping (a, b) -> True if a precedes b
+        precedence: PrecedenceRelation of constraints (a, b), a precedes b
     """
     # Check file extension to determine format
     if filename.endswith('.yaml') or filename.endswith('.yml'):
@@ -43,7 +45,7 @@ def read_yaml(filename):
         n: Number of activities
         durations: List of durations
         probabilities: List of KO probabilities
-        precedence: Dict mapping (a, b) -> True if a precedes b
+        precedence: PrecedenceRelation of constraints (a, b), a precedes b
     """
     with open(filename, 'r') as f:
         data = yaml.safe_load(f)
@@ -66,7 +68,7 @@ def read_yaml(filename):
         probabilities.append(float(activity['ko_probability']))
     
     # Extract precedence constraints
-    precedence = {}
+    precedence = PrecedenceRelation(n)
     precedence_list = data.get('precedence', [])
     
     for constraint in precedence_list:
@@ -102,7 +104,7 @@ def read_legacy(filename):
         n: Number of activities
         durations: List of durations
         probabilities: List of KO probabilities
-        precedence: Dict mapping (a, b) -> True if a precedes b
+        precedence: PrecedenceRelation of constraints (a, b), a precedes b
     """
     with open(filename) as f:
         lines = [line.strip() for line in f.readlines() if line.strip()]
@@ -117,7 +119,7 @@ def read_legacy(filename):
         probabilities.append(float(parts[1]))
     
     m = int(lines[n + 1])
-    precedence = {}
+    precedence = PrecedenceRelation(n)
     
     for i in range(n + 2, n + m + 2):
         parts = lines[i].split()
@@ -149,25 +151,25 @@ def validate(activities, precedence, durations, probabilities, refined_precedenc
     from koref_utils import (
         compute_earliest_start_schedule,
         compute_expected_makespan,
-        check_acyclic,
     )
     
     # Check that refined precedence extends original (using transitive closure)
     # A refinement means the refined precedence should include all original constraints
     # (either directly or transitively)
-    from koref_utils import compute_transitive_closure
-    
-    original_closure = compute_transitive_closure(precedence, len(activities))
-    refined_closure = compute_transitive_closure(refined_precedence, len(activities))
+    n = len(activities)
+    original_closure = as_relation(precedence, n).closure()
+    refined_closure = as_relation(refined_precedence, n).closure()
     
     # Check that every constraint in original_closure is also in refined_closure
-    for (a, b) in original_closure:
-        if original_closure.get((a, b), False) and not refined_closure.get((a, b), False):
+    for a in range(n):
+        missing = original_closure.rows[a] & ~refined_closure.rows[a]
+        if missing:
+            b = (missing & -missing).bit_length() - 1
             print(f"Error: Refined precedence missing original constraint ({a}, {b})")
             return False
     
     # Check acyclicity
-    if not check_acyclic(refined_precedence, len(activities)):
+    if not refined_closure.is_acyclic():
         print("Error: Refined precedence contains cycles")
         return False
     